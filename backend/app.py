@@ -1,32 +1,88 @@
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from sqlalchemy import create_engine
 from sqlalchemy.pool import QueuePool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import os
+import asyncio
 import logging
-from functools import lru_cache
-from typing import Tuple
+from functools import partial
+from typing import Optional, Tuple
 import time
 import json
+import numpy as np
+from contextlib import asynccontextmanager
 from concurrent.futures import ThreadPoolExecutor
-from core.geocod import geocode_ban, get_biens_proches
+from core.geocod import (
+    creer_client_ban,
+    geocode_ban_async,
+    get_biens_proches,
+    get_stats_proches,
+    get_tendance,
+    get_annees,
+    haversine_distance_batch,
+    CHAMPS_BIENS,
+    TABLE_BIENS,
+)
+from core.index_spatial import IndexSpatial
+from core.moteur_duckdb import MoteurDuckDB
+from core.cube import cube_disponible, get_stats_cube
+from core.cache import CacheTTL
+from core.cache_geocodage import CacheGeocodage, normaliser_adresse
+from core.geocodeur_local import GeocodeurLocal
+from core.singleflight import SingleFlight
+from core.formats import negocier_format, reponse_biens
+from core.compression import MiddlewareCompression
+from core.cache_http import MiddlewareETag, lire_version_donnees
 from core.llm_assistant import analyse_biens_par_llm_stream  # Version streaming
 from dotenv import load_dotenv
-from core.stat_compute import (
-    prix_m2_moyen_par_type,
-    prix_m2_max_par_type,
-    prix_m2_min_par_type,
-    surface_moyenne_par_type,
-    nombre_pieces_moyen_par_type,
-    nombre_biens_par_type,
-)
 
 load_dotenv()
 
-app = FastAPI(title="API Immobilier Optimisée", version="2.0.0")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Démarrage : version des données, client HTTP du géocodage, géocodeur
+    local et, selon le moteur choisi, chargement de l'index spatial ou
+    ouverture du fichier Parquet
+    """
+    if MOTEUR_RECHERCHE == "duckdb":
+        param["index_spatial"] = MoteurDuckDB.depuis_parquet(
+            FICHIER_PARQUET, param["logger"]
+        )
+    elif param["engine"] is None:
+        raise RuntimeError(f"NEON_DB_URL requis par le moteur {MOTEUR_RECHERCHE}")
+    param["version_donnees"] = lire_version()
+    param["client_ban"] = creer_client_ban(BAN_CONCURRENCE, BAN_TIMEOUT_S)
+    param["semaphore_ban"] = asyncio.Semaphore(BAN_CONCURRENCE)
+    charger_donnees_locales()
+    if MOTEUR_RECHERCHE == "sql" and STATS_CUBE:
+        param["cube"] = cube_disponible(param["engine"])
+        param["logger"].info(
+            f"Cube d'agrégats {'utilisé' if param['cube'] else 'absent'}"
+        )
+    param["logger"].info(f"Moteur de recherche : {MOTEUR_RECHERCHE}")
+    yield
+    param.pop("index_spatial", None)
+    param.pop("cube", None)
+    param.pop("geocodeur_local", None)
+    await param.pop("client_ban").aclose()
+    param["executor"].shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="API Immobilier Optimisée", version="2.0.0", lifespan=lifespan)
+
+# Réponses de recherche compressées (brotli ou gzip) et conditionnelles :
+# ETag dérivé de la version des données et des paramètres, 304 si inchangé
+app.add_middleware(MiddlewareCompression)
+app.add_middleware(
+    MiddlewareETag,
+    chemins=["/biens_proches", "/tendance", "/autocomplete", "/annees"],
+    version=lambda: f"{app.version}:{param['version_donnees']}",
+    max_age_s=int(os.getenv("CACHE_HTTP_MAX_AGE", "3600")),
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -36,107 +92,358 @@ app.add_middleware(
 
 param = {}
 
-# Configuration de la base de données
+# Bornes (annee_min, annee_max) des ventes d'une recherche, None : sans borne
+Annees = Tuple[Optional[int], Optional[int]]
+
+# Configuration de la base de données (facultative avec le moteur duckdb)
 DATABASE_URL = os.getenv("NEON_DB_URL")
-param["engine"] = create_engine(
-    DATABASE_URL,
-    poolclass=QueuePool,
-    pool_size=10,
-    max_overflow=20,
-    pool_pre_ping=True,
-    pool_recycle=3600,
-    echo=False,
+POOL_SIZE = 10
+MAX_OVERFLOW = 20
+param["engine"] = (
+    create_engine(
+        DATABASE_URL,
+        poolclass=QueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        echo=False,
+    )
+    if DATABASE_URL
+    else None
+)
+
+# Exécuteur borné pour les appels bloquants à la base de données :
+# autant de threads que de connexions disponibles dans le pool, pour ne
+# jamais bloquer la boucle d'événements d'uvicorn
+param["executor"] = ThreadPoolExecutor(
+    max_workers=POOL_SIZE + MAX_OVERFLOW, thread_name_prefix="bloquant"
 )
 
+# Moteur de recherche des biens : "sql" (requête Neon à chaque appel),
+# "memoire" (table chargée au démarrage dans un index spatial) ou "duckdb"
+# (fichier Parquet du dataset builder interrogé localement, sans Neon)
+MOTEURS_RECHERCHE = ("sql", "memoire", "duckdb")
+MOTEUR_RECHERCHE = os.getenv("MOTEUR_RECHERCHE", "sql").strip().lower()
+if MOTEUR_RECHERCHE not in MOTEURS_RECHERCHE:
+    raise RuntimeError(
+        f"MOTEUR_RECHERCHE inconnu : {MOTEUR_RECHERCHE!r} "
+        f"(valeurs possibles : {', '.join(MOTEURS_RECHERCHE)})"
+    )
+FICHIER_PARQUET = os.getenv(
+    "DVF_PARQUET",
+    os.path.join(os.path.dirname(__file__), "valeurs_foncieres_idf.parquet"),
+)
+
+# Statistiques du moteur SQL servies par le cube d'agrégats (par tuile, type
+# et mois) s'il a été construit par le dataset builder, à partir d'un rayon
+# minimal : en deçà, l'agrégation des ventes brutes est plus rapide et ses
+# médianes sont exactes
+STATS_CUBE = os.getenv("STATS_CUBE", "1") == "1"
+STATS_CUBE_RAYON_MIN = int(os.getenv("STATS_CUBE_RAYON_MIN", "500"))
+
+# Géocodage BAN : nombre d'appels simultanés et timeout par appel
+BAN_CONCURRENCE = int(os.getenv("BAN_CONCURRENCE", "10"))
+BAN_TIMEOUT_S = float(os.getenv("BAN_TIMEOUT", "5"))
+
+# Géocodeur local (adresses des ventes DVF) consulté avant l'API BAN
+GEOCODEUR_LOCAL = os.getenv("GEOCODEUR_LOCAL", "1") == "1"
+
+# Cache persistant des géocodages (fichier SQLite partagé entre workers)
+param["cache_geocodage"] = CacheGeocodage(
+    os.getenv(
+        "GEOCACHE_CHEMIN",
+        os.path.join(os.path.dirname(__file__), "geocodage_cache.sqlite"),
+    ),
+    ttl_positif_s=float(os.getenv("GEOCACHE_TTL_POSITIF", str(30 * 24 * 3600))),
+    ttl_negatif_s=float(os.getenv("GEOCACHE_TTL_NEGATIF", "3600")),
+    taille_max=int(os.getenv("GEOCACHE_TAILLE", "100000")),
+)
+
+# Rayon maximal proposé par l'interface : chaque recherche est faite à ce rayon
+# puis les rayons plus petits sont servis depuis le cache
+RAYON_MAX_M = 1000
+
+# Cache des résultats de recherche, partagé par /biens_proches et /analyse_stream
+param["cache_biens"] = CacheTTL(
+    taille_max=int(os.getenv("CACHE_BIENS_TAILLE", "512")),
+    ttl_s=float(os.getenv("CACHE_BIENS_TTL", "3600")),
+)
+
+# Coalescence des recherches identiques simultanées (géocodage, base, LLM)
+param["singleflight"] = SingleFlight()
+
 logging.basicConfig(level=logging.INFO)
 param["logger"] = logging.getLogger(__name__)
 
 
-@lru_cache(maxsize=1000)
-def geocode_cached(adresse: str) -> Tuple[float, float]:
-    """Géocodage avec cache pour éviter les appels répétés"""
+def lire_version() -> str:
+    """Version des données : métadonnées du fichier Parquet (moteur duckdb) ou base"""
+    if MOTEUR_RECHERCHE == "duckdb":
+        return param["index_spatial"].version(param["logger"])
+    return lire_version_donnees(param["engine"], TABLE_BIENS, param["logger"])
+
+
+def charger_donnees_locales() -> None:
+    """
+    Charge les données servies depuis la mémoire : géocodeur local (table
+    des adresses ou fichier Parquet) et index spatial du moteur mémoire.
+    Appelé au démarrage et par `/clear_cache` après une ingestion.
+    """
+    if GEOCODEUR_LOCAL:
+        try:
+            if MOTEUR_RECHERCHE == "duckdb":
+                param["geocodeur_local"] = GeocodeurLocal(
+                    param["index_spatial"].adresses()
+                )
+                param["logger"].info(
+                    f"Géocodeur local chargé depuis {FICHIER_PARQUET} "
+                    f"({len(param['geocodeur_local'])} adresses)"
+                )
+            else:
+                param["geocodeur_local"] = GeocodeurLocal.depuis_base(
+                    param["engine"], logger=param["logger"]
+                )
+        except Exception as e:
+            param["logger"].warning(f"Géocodeur local indisponible : {e}")
+    if MOTEUR_RECHERCHE == "memoire":
+        param["index_spatial"] = IndexSpatial.depuis_base(
+            param["engine"], TABLE_BIENS, param["logger"]
+        )
+
+
+async def executer_bloquant(fonction, *args):
+    """Exécute un appel bloquant dans l'exécuteur dédié sans bloquer la boucle"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(param["executor"], partial(fonction, *args))
+
+
+async def geocode_cached(adresse: str) -> Tuple[float, float]:
+    """
+    Géocodage asynchrone avec cache persistant pour éviter les appels répétés.
+    Les adresses introuvables sont mises en cache (durée de vie courte), les
+    erreurs réseau ne le sont pas. Les géocodages simultanés d'une même
+    adresse (normalisée) ne font qu'un appel. Le cache SQLite est lu et
+    écrit dans l'exécuteur : un verrou tenu par un autre worker ne bloque
+    pas la boucle.
+    """
+    coords = await executer_bloquant(param["cache_geocodage"].lire, adresse)
+    if coords is None:
+        coords = await param["singleflight"].executer(
+            ("geocodage", normaliser_adresse(adresse)),
+            lambda: _geocoder(adresse),
+        )
+
+    if coords[0] is None:
+        raise HTTPException(
+            status_code=400, detail=f"Impossible de géocoder l'adresse: {adresse}"
+        )
+    return coords
+
+
+async def _geocoder(adresse: str) -> Tuple[float, float]:
+    """Géocodage (local puis BAN) et mise en cache du résultat"""
     try:
-        lat, lon = geocode_ban(adresse)
-        return lat, lon
+        coords = await geocode_ban_async(
+            adresse,
+            param["client_ban"],
+            param["semaphore_ban"],
+            BAN_TIMEOUT_S,
+            lever_erreurs_reseau=True,
+            geocodeur_local=param.get("geocodeur_local"),
+        )
     except Exception as e:
         param["logger"].error(f"Erreur géocodage pour {adresse}: {e}")
         raise HTTPException(
             status_code=400, detail=f"Impossible de géocoder l'adresse: {adresse}"
         )
+    await executer_bloquant(param["cache_geocodage"].ecrire, adresse, coords)
+    return coords
+
+
+def _annees(annee_min: Optional[int], annee_max: Optional[int]) -> Annees:
+    """Bornes d'années d'une requête, vérifiées"""
+    if annee_min is not None and annee_max is not None and annee_min > annee_max:
+        raise HTTPException(
+            status_code=400, detail="annee_min doit être inférieure ou égale à annee_max"
+        )
+    return annee_min, annee_max
+
+
+def _periode(annees: Annees) -> Optional[str]:
+    """Période des ventes en toutes lettres (None : toutes les années)"""
+    annee_min, annee_max = annees
+    if annee_min is not None and annee_min == annee_max:
+        return f"en {annee_min}"
+    if annee_min is not None and annee_max is not None:
+        return f"entre {annee_min} et {annee_max}"
+    if annee_min is not None:
+        return f"depuis {annee_min}"
+    if annee_max is not None:
+        return f"jusqu'en {annee_max}"
+    return None
+
+
+def _charger_biens(lat_q: float, lon_q: float, annees: Annees) -> tuple:
+    """
+    Recherche au rayon maximal et mise en cache (appel bloquant).
+
+    :return: (biens triés par distance, distances exactes correspondantes)
+    """
+    biens = get_biens_proches(lat_q, lon_q, RAYON_MAX_M, param, *annees)
+    distances = haversine_distance_batch(
+        lat_q,
+        lon_q,
+        [b["latitude"] for b in biens],
+        [b["longitude"] for b in biens],
+    )
+    entree = (biens, distances)
+    param["cache_biens"].ecrire((lat_q, lon_q, *annees), entree)
+    return entree
+
+
+async def rechercher_biens(
+    lat: float, lon: float, rayon_m: int, annees: Annees = (None, None)
+) -> list:
+    """
+    Recherche des biens avec cache partagé entre les endpoints.
+    Les coordonnées sont quantifiées (≈ 1 m) pour former la clé, et la
+    recherche est faite sur ces coordonnées quantifiées, au rayon maximal.
+    Un rayon plus petit est servi par recherche dichotomique dans la liste
+    en cache, triée par distance (sur les distances exactes, `distance_m`
+    étant arrondie). Les recherches simultanées d'un même point ne font
+    qu'une requête.
+
+    :param annees: Bornes (annee_min, annee_max) des ventes, None : sans borne
+    """
+    if rayon_m > RAYON_MAX_M:
+        return await executer_bloquant(
+            get_biens_proches, lat, lon, rayon_m, param, *annees
+        )
+
+    lat_q, lon_q = round(lat, 5), round(lon, 5)
+
+    entree = param["cache_biens"].lire((lat_q, lon_q, *annees))
+    if entree is None:
+        entree = await param["singleflight"].executer(
+            ("biens", lat_q, lon_q, *annees),
+            lambda: executer_bloquant(_charger_biens, lat_q, lon_q, annees),
+        )
+
+    biens, distances = entree
+    return biens[: int(np.searchsorted(distances, rayon_m, side="right"))]
+
+
+async def _agreger(
+    nom: str, calcul, lat: float, lon: float, rayon_m: int, annees: Annees
+):
+    """
+    Agrégats des ventes du rayon calculés par `calcul`, avec le même cache
+    et la même quantification que `rechercher_biens`.
+
+    Contrairement à la liste des biens, les agrégats sont calculés et mis en
+    cache pour chaque rayon : un changement de rayon relance une agrégation
+    (par la base, le cube ou le moteur local). Les dériver de la recherche au
+    rayon maximal obligerait à rapatrier toutes les ventes du rayon maximal,
+    ce que l'agrégation côté serveur évite ; seule la liste, limitée à
+    `LIMITE_BIENS` biens, est servie depuis le rayon maximal.
+    """
+    lat_q, lon_q = round(lat, 5), round(lon, 5)
+    cle = (nom, lat_q, lon_q, rayon_m, *annees)
+
+    agregats = param["cache_biens"].lire(cle)
+    if agregats is None:
+        agregats = await param["singleflight"].executer(
+            cle,
+            lambda: executer_bloquant(
+                calcul, lat_q, lon_q, rayon_m, param, *annees
+            ),
+        )
+        param["cache_biens"].ecrire(cle, agregats)
+    return agregats
+
+
+async def rechercher_stats(
+    lat: float, lon: float, rayon_m: int, annees: Annees = (None, None)
+) -> dict:
+    """
+    Statistiques de toutes les ventes du rayon (voir `get_stats_proches`,
+    ou `get_stats_cube` si le cube d'agrégats est disponible et le rayon
+    d'au moins `STATS_CUBE_RAYON_MIN`), en cache par rayon : une agrégation
+    par point, rayon et période
+    """
+    calcul = (
+        get_stats_cube
+        if param.get("cube") and rayon_m >= STATS_CUBE_RAYON_MIN
+        else get_stats_proches
+    )
+    return await _agreger("stats", calcul, lat, lon, rayon_m, annees)
 
 
 # Endpoint pour les données de base (sans analyse LLM)
 @app.get("/biens_proches")
 async def biens_proches(
+    request: Request,
     adresse: str = Query(..., description="Adresse en Île-de-France"),
     rayon_m: int = Query(500, ge=100, le=1000, description="Rayon en mètres"),
+    annee_min: Optional[int] = Query(
+        None, description="Première année des ventes (toutes par défaut)"
+    ),
+    annee_max: Optional[int] = Query(
+        None, description="Dernière année des ventes (toutes par défaut)"
+    ),
+    format: Optional[str] = Query(
+        None,
+        pattern="^(json|colonnes|msgpack)$",
+        description="Format de réponse (sinon négocié par l'en-tête Accept)",
+    ),
 ):
     """
-    Endpoint pour récupérer les biens immobiliers proches 
+    Endpoint pour récupérer les biens immobiliers proches.
+    `biens_proches` est une liste d'objets (json) ou un objet de colonnes
+    (colonnes, msgpack)
     """
     start_time = time.time()
+    format_reponse = negocier_format(request.headers.get("accept"), format)
+    annees = _annees(annee_min, annee_max)
 
     try:
         # 1. Géocodage avec cache
-        lat, lon = geocode_cached(adresse)
+        lat, lon = await geocode_cached(adresse)
         coord = (lat, lon)
         param["logger"].info(f"Géocodage: {adresse} -> ({lat}, {lon})")
 
-        # 2. Recherche des biens
-        biens = get_biens_proches(lat, lon, rayon_m, param)
+        # 2. Recherche des biens les plus proches et statistiques de toutes
+        # les ventes du rayon (avec cache)
+        biens, agregats = await asyncio.gather(
+            rechercher_biens(lat, lon, rayon_m, annees),
+            rechercher_stats(lat, lon, rayon_m, annees),
+        )
 
         if not biens:
-            return {
+            corps = {
                 "biens_proches": [],
                 "stats": {
                     "nb_biens": 0,
                     "temps_execution": round(time.time() - start_time, 2),
                 },
             }
+            return reponse_biens(corps, format_reponse, CHAMPS_BIENS)
 
-        # 3. Calcul des statistiques de base
+        # 3. Statistiques sur l'ensemble du rayon, la liste étant limitée
         stats = {
-            "nb_biens": len(biens),
-            "prix_moyen": (
-                round(
-                    sum(b["prix_m2"] for b in biens if b["prix_m2"])
-                    / len([b for b in biens if b["prix_m2"]]),
-                    2,
-                )
-                if biens
-                else 0
-            ),
-            "surface_moyenne": (
-                round(
-                    sum(
-                        b["surface_reelle_bati"]
-                        for b in biens
-                        if b["surface_reelle_bati"]
-                    )
-                    / len([b for b in biens if b["surface_reelle_bati"]]),
-                    2,
-                )
-                if biens
-                else 0
-            ),
-            "distance_max": max(b["distance_m"] for b in biens) if biens else 0,
+            **agregats["stats"],
+            "nb_biens_affiches": len(biens),
             "temps_execution": round(time.time() - start_time, 2),
         }
-        stats_per_type = {
-            "prix_m2_moyen_par_type": prix_m2_moyen_par_type(biens),
-            "prix_m2_max_par_type": prix_m2_max_par_type(biens),
-            "prix_m2_min_par_type": prix_m2_min_par_type(biens),
-            "surface_moyenne_par_type": surface_moyenne_par_type(biens),
-            "nombre_pieces_moyen_par_type": nombre_pieces_moyen_par_type(biens),
-            "nombre_biens_par_type": nombre_biens_par_type(biens),
-        }
 
-        return {
+        corps = {
             "biens_proches": biens,
             "stats": stats,
-            "stats_per_type": stats_per_type,
+            "stats_per_type": agregats["stats_per_type"],
             "coord": coord,
         }
+        return reponse_biens(corps, format_reponse, CHAMPS_BIENS)
 
     except HTTPException:
         raise
@@ -145,19 +452,75 @@ async def biens_proches(
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
 
 
+# Endpoint de l'évolution mensuelle des prix
+@app.get("/tendance")
+async def tendance(
+    adresse: str = Query(..., description="Adresse en Île-de-France"),
+    rayon_m: int = Query(500, ge=100, le=1000, description="Rayon en mètres"),
+    annee_min: Optional[int] = Query(
+        None, description="Première année des ventes (toutes par défaut)"
+    ),
+    annee_max: Optional[int] = Query(
+        None, description="Dernière année des ventes (toutes par défaut)"
+    ),
+):
+    """
+    Nombre de ventes, prix au m² moyen et médian par type de bien et par
+    mois pour toutes les ventes du rayon (voir `get_tendance`)
+    """
+    start_time = time.time()
+    annees = _annees(annee_min, annee_max)
+    try:
+        lat, lon = await geocode_cached(adresse)
+        series = await _agreger("tendance", get_tendance, lat, lon, rayon_m, annees)
+        return {
+            "tendance": series,
+            "coord": (lat, lon),
+            "temps_execution": round(time.time() - start_time, 2),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        param["logger"].error(f"Erreur inattendue tendance: {e}")
+        raise HTTPException(status_code=500, detail="Erreur interne du serveur")
+
+
+# Endpoint des années disponibles
+@app.get("/annees")
+async def annees_disponibles():
+    """
+    Première et dernière années des ventes disponibles (bornes du filtre par
+    années du frontend), null si aucune vente
+    """
+    bornes = await executer_bloquant(get_annees, param)
+    if bornes is None:
+        return {"annee_min": None, "annee_max": None}
+    return {"annee_min": bornes[0], "annee_max": bornes[1]}
+
+
 # Nouveau endpoint pour l'analyse LLM en streaming
 @app.get("/analyse_stream")
 async def analyse_stream(
     adresse: str = Query(..., description="Adresse en Île-de-France"),
     rayon_m: int = Query(500, ge=100, le=1000, description="Rayon en mètres"),
+    annee_min: Optional[int] = Query(
+        None, description="Première année des ventes (toutes par défaut)"
+    ),
+    annee_max: Optional[int] = Query(
+        None, description="Dernière année des ventes (toutes par défaut)"
+    ),
 ):
     """
     Endpoint pour l'analyse LLM en streaming
     """
+    annees = _annees(annee_min, annee_max)
     try:
         # Récupération des biens 
-        lat, lon = geocode_cached(adresse)
-        biens = get_biens_proches(lat, lon, rayon_m, param)
+        lat, lon = await geocode_cached(adresse)
+        biens, agregats = await asyncio.gather(
+            rechercher_biens(lat, lon, rayon_m, annees),
+            rechercher_stats(lat, lon, rayon_m, annees),
+        )
 
         if not biens:
 
@@ -167,7 +530,7 @@ async def analyse_stream(
 
             return StreamingResponse(
                 empty_stream(),
-                media_type="text/plain",
+                media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
                     "Connection": "keep-alive",
@@ -181,8 +544,18 @@ async def analyse_stream(
                 start_message = "Reflexion..."
                 yield f"data: {json.dumps({'type': 'start', 'content': start_message})}\n\n"
 
-                # Appel de la fonction d'analyse streaming
-                async for chunk in analyse_biens_par_llm_stream(biens, rayon_m, param):
+                # Appel de la fonction d'analyse streaming, partagée entre
+                # les demandes simultanées pour la même recherche
+                async for chunk in param["singleflight"].diffuser(
+                    ("analyse", round(lat, 5), round(lon, 5), rayon_m, *annees),
+                    lambda: analyse_biens_par_llm_stream(
+                        biens,
+                        rayon_m,
+                        param,
+                        agregats["stats_per_type"],
+                        _periode(annees),
+                    ),
+                ):
                     if chunk:
                         yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
 
@@ -196,7 +569,7 @@ async def analyse_stream(
 
         return StreamingResponse(
             generate_analysis(),
-            media_type="text/plain",
+            media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
                 "Connection": "keep-alive",
@@ -209,14 +582,53 @@ async def analyse_stream(
         raise HTTPException(status_code=500, detail="Erreur interne du serveur")
 
 
+# Endpoint d'autocomplétion des adresses
+@app.get("/autocomplete")
+async def autocomplete(
+    q: str = Query(..., min_length=2, description="Début d'adresse saisi"),
+    limite: int = Query(10, ge=1, le=50, description="Nombre de suggestions"),
+):
+    """
+    Suggestions d'adresses, voies et communes d'Île-de-France, servies par
+    l'index de préfixes en mémoire du géocodeur local (sans base ni réseau)
+    """
+    geocodeur = param.get("geocodeur_local")
+    suggestions = geocodeur.suggerer(q, limite) if geocodeur is not None else []
+    return JSONResponse(
+        {"suggestions": suggestions},
+        headers={"Cache-Control": "public, max-age=86400"},
+    )
+
+
 # Endpoint pour nettoyer le cache
 @app.post("/clear_cache")
 async def clear_cache():
-    """Nettoie le cache de géocodage"""
-    geocode_cached.cache_clear()
+    """
+    Nettoie le cache de géocodage et le cache des recherches, recharge les
+    données en mémoire (index spatial, géocodeur local) et relit la version
+    des données (invalidation des ETags après une ingestion). La version est
+    lue avant le rechargement : les données servies ne sont jamais plus
+    anciennes que la version annoncée.
+    """
+    await executer_bloquant(param["cache_geocodage"].vider)
+    version = await executer_bloquant(lire_version)
+    await executer_bloquant(charger_donnees_locales)
+    param["cache_biens"].vider()
+    param["version_donnees"] = version
     return {"message": "Cache nettoyé avec succès"}
 
 
+# Endpoint de suivi des caches
+@app.get("/cache_stats")
+async def cache_stats():
+    """Statistiques d'utilisation des caches"""
+    return {
+        "geocodage": await executer_bloquant(param["cache_geocodage"].stats),
+        "biens": param["cache_biens"].stats(),
+        "coalescence": param["singleflight"].stats(),
+    }
+
+
 # Gestion des erreurs
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
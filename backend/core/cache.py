@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class CacheTTL:
+    """
+    Cache LRU en mémoire, borné en taille et avec expiration (TTL).
+    Partagé entre les endpoints et protégé par un verrou.
+    """
+
+    def __init__(self, taille_max: int = 512, ttl_s: Optional[float] = 3600):
+        """
+        :param taille_max: Nombre maximum d'entrées conservées
+        :param ttl_s: Durée de vie d'une entrée en secondes (None : sans expiration)
+        """
+        self.taille_max = taille_max
+        self.ttl_s = ttl_s
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lire(self, cle: Hashable) -> Optional[Any]:
+        """Retourne la valeur en cache ou None si absente ou expirée"""
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is not None:
+                expiration, valeur = entree
+                if expiration is None or expiration > time.monotonic():
+                    self._entrees.move_to_end(cle)
+                    self.hits += 1
+                    return valeur
+                del self._entrees[cle]
+            self.misses += 1
+            return None
+
+    def ecrire(self, cle: Hashable, valeur: Any) -> None:
+        """Ajoute ou remplace une entrée, en évinçant la plus ancienne si besoin"""
+        expiration = time.monotonic() + self.ttl_s if self.ttl_s is not None else None
+        with self._verrou:
+            self._entrees[cle] = (expiration, valeur)
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.taille_max:
+                self._entrees.popitem(last=False)
+                self.evictions += 1
+
+    def vider(self) -> None:
+        """Supprime toutes les entrées (les compteurs sont conservés)"""
+        with self._verrou:
+            self._entrees.clear()
+
+    def stats(self) -> dict:
+        """Taille, compteurs de hits/misses et taux de succès"""
+        with self._verrou:
+            total = self.hits + self.misses
+            return {
+                "taille": len(self._entrees),
+                "taille_max": self.taille_max,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "taux_hit": round(self.hits / total, 3) if total else 0.0,
+            }
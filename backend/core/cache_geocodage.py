@@ -0,0 +1,180 @@
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Optional, Tuple
+
+
+# Abréviations courantes des types de voie et des prénoms de saints
+ABREVIATIONS = {
+    "all": "allee",
+    "av": "avenue",
+    "ave": "avenue",
+    "bd": "boulevard",
+    "bld": "boulevard",
+    "bvd": "boulevard",
+    "ch": "chemin",
+    "che": "chemin",
+    "crs": "cours",
+    "fbg": "faubourg",
+    "fg": "faubourg",
+    "imp": "impasse",
+    "pl": "place",
+    "qu": "quai",
+    "r": "rue",
+    "rte": "route",
+    "sq": "square",
+    "st": "saint",
+    "ste": "sainte",
+}
+
+
+def normaliser_adresse(adresse: str) -> str:
+    """
+    Forme normalisée d'une adresse : minuscules, sans accents ni ponctuation,
+    espaces réduits et abréviations de voie développées
+    ("12, Bd Saint-Germain" -> "12 boulevard saint germain").
+    """
+    texte = unicodedata.normalize("NFKD", adresse.lower())
+    texte = "".join(c for c in texte if not unicodedata.combining(c))
+    mots = re.sub(r"[^a-z0-9]+", " ", texte).split()
+    return " ".join(ABREVIATIONS.get(mot, mot) for mot in mots)
+
+
+class CacheGeocodage:
+    """
+    Cache persistant (SQLite) des géocodages, partagé entre les redémarrages
+    et les workers uvicorn. Les clés sont les adresses normalisées ; les
+    échecs (adresse introuvable) sont conservés moins longtemps que les succès.
+
+    Une lecture n'écrit rien dans SQLite : les dates d'accès (ordre
+    d'éviction) sont gardées en mémoire et enregistrées à l'écriture suivante.
+    """
+
+    def __init__(
+        self,
+        chemin: str,
+        ttl_positif_s: float = 30 * 24 * 3600,
+        ttl_negatif_s: float = 3600,
+        taille_max: int = 100000,
+    ):
+        """
+        :param chemin: Fichier SQLite du cache
+        :param ttl_positif_s: Durée de vie d'un géocodage réussi
+        :param ttl_negatif_s: Durée de vie d'un échec de géocodage
+        :param taille_max: Nombre maximum d'adresses conservées
+        """
+        self.ttl_positif_s = ttl_positif_s
+        self.ttl_negatif_s = ttl_negatif_s
+        self.taille_max = taille_max
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._verrou = threading.Lock()
+        # Dates d'accès des lectures réussies, en attente d'enregistrement
+        self._acces = {}
+
+        self._conn = sqlite3.connect(chemin, timeout=5, check_same_thread=False)
+        with self._conn:
+            # WAL : lectures concurrentes depuis plusieurs workers
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS geocodage (
+                    cle TEXT PRIMARY KEY,
+                    latitude REAL,
+                    longitude REAL,
+                    expiration REAL NOT NULL,
+                    acces REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_geocodage_acces ON geocodage (acces)"
+            )
+
+    def lire(self, adresse: str) -> Optional[Tuple[float, float]]:
+        """
+        Coordonnées en cache pour l'adresse.
+
+        :return: (lat, lon), (None, None) pour un échec en cache, None si absente
+        """
+        cle = normaliser_adresse(adresse)
+        maintenant = time.time()
+        with self._verrou, self._conn:
+            ligne = self._conn.execute(
+                "SELECT latitude, longitude, expiration FROM geocodage WHERE cle = ?",
+                (cle,),
+            ).fetchone()
+            if ligne is None or ligne[2] <= maintenant:
+                self.misses += 1
+                return None
+            self._acces[cle] = maintenant
+            self.hits += 1
+            return ligne[0], ligne[1]
+
+    def ecrire(self, adresse: str, coords: Tuple[float, float]) -> None:
+        """Enregistre un géocodage ((None, None) pour un échec)"""
+        cle = normaliser_adresse(adresse)
+        maintenant = time.time()
+        ttl = self.ttl_positif_s if coords[0] is not None else self.ttl_negatif_s
+        with self._verrou, self._conn:
+            # Dates d'accès des lectures depuis la dernière écriture
+            self._conn.executemany(
+                "UPDATE geocodage SET acces = ? WHERE cle = ?",
+                [(acces, c) for c, acces in self._acces.items()],
+            )
+            self._acces.clear()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocodage VALUES (?, ?, ?, ?, ?)",
+                (cle, coords[0], coords[1], maintenant + ttl, maintenant),
+            )
+            self._evincer(maintenant)
+
+    def _evincer(self, maintenant: float) -> None:
+        """
+        Au-delà de la taille maximale, supprime les entrées expirées puis les
+        moins récemment lues
+        """
+        (taille,) = self._conn.execute("SELECT COUNT(*) FROM geocodage").fetchone()
+        if taille <= self.taille_max:
+            return
+        self._conn.execute("DELETE FROM geocodage WHERE expiration <= ?", (maintenant,))
+        (taille,) = self._conn.execute("SELECT COUNT(*) FROM geocodage").fetchone()
+        if taille > self.taille_max:
+            surplus = taille - self.taille_max
+            self._conn.execute(
+                """
+                DELETE FROM geocodage WHERE cle IN (
+                    SELECT cle FROM geocodage ORDER BY acces LIMIT ?
+                )
+                """,
+                (surplus,),
+            )
+            self.evictions += surplus
+
+    def vider(self) -> None:
+        """Supprime toutes les entrées (les compteurs sont conservés)"""
+        with self._verrou, self._conn:
+            self._conn.execute("DELETE FROM geocodage")
+            self._acces.clear()
+
+    def stats(self) -> dict:
+        """Taille, échecs en cache, hits/misses et évictions de ce processus"""
+        with self._verrou:
+            taille, negatifs = self._conn.execute(
+                "SELECT COUNT(*), COUNT(*) - COUNT(latitude) FROM geocodage"
+            ).fetchone()
+            total = self.hits + self.misses
+            return {
+                "taille": taille,
+                "taille_max": self.taille_max,
+                "negatifs": negatifs,
+                "ttl_positif_s": self.ttl_positif_s,
+                "ttl_negatif_s": self.ttl_negatif_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "taux_hit": round(self.hits / total, 3) if total else 0.0,
+            }
@@ -0,0 +1,134 @@
+import hashlib
+import time
+from typing import Callable, Iterable
+
+from sqlalchemy import text
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.compression import encodage_negocie
+
+
+# Table des versions des données, écrite par le dataset builder
+TABLE_METADONNEES = "metadonnees_dvf"
+
+
+def lire_version_donnees(engine, table: str, logger=None) -> str:
+    """
+    Version des données de `table` enregistrée lors de l'ingestion
+    (empreinte du contenu). À défaut, une version propre à ce démarrage :
+    les ETags restent alors valables jusqu'au redémarrage.
+
+    :param engine: Engine SQLAlchemy
+    :param table: Table des biens
+    :param logger: Logger optionnel
+    """
+    query = text(
+        f"SELECT version FROM {TABLE_METADONNEES} WHERE table_donnees = :table"
+    )
+    try:
+        with engine.connect() as conn:
+            version = conn.execute(query, {"table": table}).scalar()
+    except Exception as e:
+        version = None
+        if logger:
+            logger.warning(f"Version des données illisible : {e}")
+    if version is None:
+        version = f"demarrage-{time.time_ns()}"
+    if logger:
+        logger.info(f"Version des données : {version}")
+    return version
+
+
+def calculer_etag(version: str, scope: Scope) -> str:
+    """
+    ETag faible d'une requête GET : version des données, chemin, paramètres
+    (triés) et variantes de la représentation (Accept, encodage négocié).
+    Faible car deux réponses de même ETag sont équivalentes sans être
+    identiques octet par octet (`temps_execution`, horodatage gzip).
+    """
+    entetes = Headers(scope=scope)
+    parametres = sorted(
+        p for p in scope.get("query_string", b"").decode("latin-1").split("&") if p
+    )
+    empreinte = hashlib.sha256(
+        "\n".join(
+            [
+                version,
+                scope["path"],
+                "&".join(parametres),
+                entetes.get("accept", ""),
+                encodage_negocie(entetes.get("accept-encoding")),
+            ]
+        ).encode()
+    )
+    return f'W/"{empreinte.hexdigest()[:32]}"'
+
+
+class MiddlewareETag:
+    """
+    Requêtes conditionnelles sur les endpoints de recherche : une réponse
+    200 reçoit un ETag et un Cache-Control public (cache d'un reverse proxy),
+    et une requête dont l'If-None-Match correspond reçoit `304 Not Modified`
+    sans être exécutée. L'ETag ne dépend que de la requête et de la version
+    des données, qui ne change qu'à l'ingestion.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        chemins: Iterable[str],
+        version: Callable[[], str],
+        max_age_s: int = 3600,
+    ):
+        """
+        :param chemins: Chemins concernés
+        :param version: Fonction retournant la version courante des données
+        :param max_age_s: Durée de fraîcheur annoncée dans Cache-Control
+        """
+        self.app = app
+        self.chemins = frozenset(chemins)
+        self.version = version
+        self.cache_control = f"public, max-age={max_age_s}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or scope["path"] not in self.chemins
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        etag = calculer_etag(self.version(), scope)
+        if_none_match = Headers(scope=scope).get("if-none-match", "")
+        etags_client = {e.strip().removeprefix("W/") for e in if_none_match.split(",")}
+        # Comparaison faible (RFC 9110) : le préfixe W/ est ignoré
+        if etag.removeprefix("W/") in etags_client:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 304,
+                    "headers": [
+                        (b"etag", etag.encode()),
+                        (b"cache-control", self.cache_control.encode()),
+                        (b"vary", b"Accept, Accept-Encoding"),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def envoyer(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                entetes = MutableHeaders(scope=message)
+                entetes["ETag"] = etag
+                if "cache-control" not in entetes:
+                    entetes["Cache-Control"] = self.cache_control
+                vary = {v.strip().lower() for v in entetes.get("vary", "").split(",")}
+                for variante in ("Accept", "Accept-Encoding"):
+                    if variante.lower() not in vary:
+                        entetes.add_vary_header(variante)
+            await send(message)
+
+        await self.app(scope, receive, envoyer)
@@ -0,0 +1,102 @@
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # dépendance optionnelle : repli sur gzip
+    brotli = None
+
+
+# Types de contenu jamais compressés (flux envoyés morceau par morceau)
+TYPES_EXCLUS = ("text/event-stream",)
+
+
+def encodage_negocie(accept_encoding: Optional[str]) -> str:
+    """
+    Encodage de compression retenu pour l'en-tête Accept-Encoding :
+    brotli si le client l'accepte et si `brotli` est installé, sinon gzip.
+
+    :return: "br", "gzip" ou "identity"
+    """
+    encodages = {
+        e.split(";")[0].strip().lower() for e in (accept_encoding or "").split(",")
+    }
+    if brotli is not None and "br" in encodages:
+        return "br"
+    if "gzip" in encodages:
+        return "gzip"
+    return "identity"
+
+
+class MiddlewareCompression:
+    """
+    Compression des réponses : brotli si possible, sinon gzip (middleware
+    Starlette). Les réponses plus petites que `taille_min` et les flux
+    (text/event-stream) ne sont pas compressés.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        taille_min: int = 500,
+        niveau_gzip: int = 6,
+        qualite_brotli: int = 5,
+    ):
+        """
+        :param taille_min: Taille minimale (octets) d'une réponse compressée
+        :param niveau_gzip: Niveau de compression gzip (1 à 9)
+        :param qualite_brotli: Qualité brotli (0 à 11)
+        """
+        self.app = app
+        self.taille_min = taille_min
+        self.qualite_brotli = qualite_brotli
+        self.gzip = GZipMiddleware(app, minimum_size=taille_min, compresslevel=niveau_gzip)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = Headers(scope=scope).get("accept-encoding")
+        if encodage_negocie(accept_encoding) != "br":
+            await self.gzip(scope, receive, send)
+            return
+
+        message_debut = None
+        en_flux = False
+
+        async def envoyer(message: Message) -> None:
+            nonlocal message_debut, en_flux
+            if message["type"] == "http.response.start":
+                # En-têtes différés : dépendent de la compression du corps
+                message_debut = message
+                return
+            if message["type"] != "http.response.body" or en_flux:
+                await send(message)
+                return
+
+            entetes = MutableHeaders(scope=message_debut)
+            corps = message.get("body", b"")
+            compressible = (
+                "content-encoding" not in entetes
+                and not entetes.get("content-type", "").startswith(TYPES_EXCLUS)
+            )
+            if message.get("more_body", False) or not compressible:
+                # Réponse en plusieurs morceaux : transmise sans compression
+                en_flux = True
+                await send(message_debut)
+                await send(message)
+                return
+
+            if len(corps) >= self.taille_min:
+                corps = brotli.compress(corps, quality=self.qualite_brotli)
+                entetes["Content-Encoding"] = "br"
+                entetes["Content-Length"] = str(len(corps))
+            if "accept-encoding" not in entetes.get("vary", "").lower():
+                entetes.add_vary_header("Accept-Encoding")
+            await send(message_debut)
+            await send({"type": "http.response.body", "body": corps})
+
+        await self.app(scope, receive, envoyer)
@@ -0,0 +1,228 @@
+import time
+from math import floor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import inspect, text
+
+from core.geocod import (
+    DISTANCE_SQL,
+    TABLE_BIENS,
+    boite_englobante,
+    filtre_annees,
+    haversine_distance_batch,
+)
+from core.sketch import SketchQuantiles
+from core.stat_compute import COLONNES_SKETCH, PERCENTILES, StatistiquesBiens
+from core.tuiles import FACTEUR_LIGNE, TUILE_DEG
+
+
+# Cube d'agrégats par tuile, type de bien, année et mois, écrit par le dataset builder
+TABLE_CUBE = "agregats_idf"
+
+
+def cube_disponible(engine, table: str = TABLE_CUBE) -> bool:
+    """Le cube d'agrégats a-t-il été construit par le dataset builder ?"""
+    try:
+        return inspect(engine).has_table(table)
+    except Exception:
+        return False
+
+
+def tuiles_du_cercle(
+    lat: float, lon: float, rayon_m: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Tuiles couvrant le cercle, séparées en tuiles intérieures (coin le plus
+    éloigné dans le rayon : toutes leurs ventes sont dans le cercle) et
+    tuiles de bord (coupées par le cercle).
+
+    :return: (clés des tuiles intérieures, clés des tuiles de bord)
+    """
+    boite = boite_englobante(lat, lon, rayon_m)
+    lignes, colonnes = np.meshgrid(
+        np.arange(
+            floor(boite["lat_min"] / TUILE_DEG), floor(boite["lat_max"] / TUILE_DEG) + 1
+        ),
+        np.arange(
+            floor(boite["lon_min"] / TUILE_DEG), floor(boite["lon_max"] / TUILE_DEG) + 1
+        ),
+        indexing="ij",
+    )
+    lat_sud, lon_ouest = lignes * TUILE_DEG, colonnes * TUILE_DEG
+    lat_nord, lon_est = lat_sud + TUILE_DEG, lon_ouest + TUILE_DEG
+
+    distance_proche = haversine_distance_batch(
+        lat, lon, np.clip(lat, lat_sud, lat_nord), np.clip(lon, lon_ouest, lon_est)
+    )
+    distance_loin = haversine_distance_batch(
+        lat,
+        lon,
+        np.where(lat - lat_sud > lat_nord - lat, lat_sud, lat_nord),
+        np.where(lon - lon_ouest > lon_est - lon, lon_ouest, lon_est),
+    )
+    cles = lignes.astype(np.int64) * FACTEUR_LIGNE + colonnes
+    interieures = distance_loin <= rayon_m
+    bord = (distance_proche <= rayon_m) & ~interieures
+    return cles[interieures], cles[bord]
+
+
+def get_stats_cube(
+    lat: float,
+    lon: float,
+    rayon_m: int,
+    param: dict,
+    annee_min: Optional[int] = None,
+    annee_max: Optional[int] = None,
+) -> Dict:
+    """
+    Statistiques de toutes les ventes du rayon à partir du cube d'agrégats :
+    les lignes du cube des tuiles intérieures sont additionnées, seules les
+    ventes des tuiles de bord sont lues et filtrées par distance. Les deux
+    parts sont combinées par la base (agrégats et compteurs des sketchs) : le
+    coût ne dépend plus que du périmètre du cercle, pas de sa densité.
+
+    Nombres, moyennes, min et max sont exacts ; médiane et percentiles (prix
+    au m² et surface) sont estimés par les sketchs (erreur relative de 1 %),
+    ce que signale `stats["quantiles_approches"]`. Le cube ne connaît pas la
+    position des ventes des tuiles intérieures : `distance_max` est la
+    distance maximale des ventes des tuiles de bord (les plus éloignées du
+    centre), None si elles sont vides.
+
+    :return: Même format que `get_stats_proches`
+    """
+    interieures, bord = tuiles_du_cercle(lat, lon, rayon_m)
+    condition_annees, params_annees = filtre_annees(annee_min, annee_max)
+    params = {
+        "lat": lat,
+        "lon": lon,
+        "rayon_m": rayon_m,
+        "interieures": interieures.tolist(),
+        "bord": bord.tolist(),
+        "ln_gamma": SketchQuantiles().ln_gamma,
+        **params_annees,
+    }
+    ventes_bord = f"""
+        SELECT *
+        FROM (
+            SELECT type_local, prix_m2, surface_reelle_bati, nombre_pieces_principales,
+                {DISTANCE_SQL} AS distance_m
+            FROM {TABLE_BIENS}
+            WHERE tuile = ANY(:bord){condition_annees}
+        ) AS candidats
+        WHERE distance_m <= :rayon_m
+    """
+    query_agregats = text(
+        f"""
+        SELECT
+            CASE WHEN GROUPING(type_local) = 0 THEN type_local END AS type_local,
+            COALESCE(SUM(nombre), 0), SUM(somme_prix) / NULLIF(SUM(nombre_prix), 0),
+            MIN(prix_min), MAX(prix_max),
+            SUM(somme_surface) / NULLIF(SUM(nombre_surface), 0),
+            SUM(somme_pieces) / NULLIF(SUM(nombre_pieces), 0),
+            MAX(distance_max)
+        FROM (
+            SELECT type_local, nombre, somme_prix, nombre_prix, prix_min, prix_max,
+                somme_surface, nombre_surface, somme_pieces, nombre_pieces,
+                NULL AS distance_max
+            FROM {TABLE_CUBE}
+            WHERE tuile = ANY(:interieures){condition_annees}
+            UNION ALL
+            SELECT type_local, COUNT(*), SUM(prix_m2), COUNT(prix_m2),
+                MIN(prix_m2), MAX(prix_m2),
+                SUM(surface_reelle_bati), COUNT(surface_reelle_bati),
+                SUM(nombre_pieces_principales), COUNT(nombre_pieces_principales),
+                MAX(distance_m)
+            FROM ({ventes_bord}) AS bord
+            GROUP BY type_local
+        ) AS parts
+        GROUP BY GROUPING SETS ((type_local), ())
+        HAVING GROUPING(type_local) = 1 OR type_local IS NOT NULL
+    """
+    )
+    # Sketchs du prix au m² et de la surface : compteurs par seau du cube et
+    # des ventes de bord
+    seaux = " UNION ALL ".join(
+        f"""
+            SELECT '{colonne}' AS colonne, type_local,
+                CAST(s.key AS INTEGER) AS seau, CAST(s.value AS BIGINT) AS nombre
+            FROM {TABLE_CUBE}, jsonb_each_text(sketch_{colonne}) AS s
+            WHERE tuile = ANY(:interieures){condition_annees}
+            UNION ALL
+            SELECT '{colonne}', type_local,
+                CAST(CEIL(LN({colonne}) / :ln_gamma) AS INTEGER), 1
+            FROM ({ventes_bord}) AS bord
+            WHERE {colonne} > 0
+        """
+        for colonne in COLONNES_SKETCH
+    )
+    query_sketchs = text(
+        f"""
+        SELECT
+            colonne,
+            CASE WHEN GROUPING(type_local) = 0 THEN type_local END AS type_local,
+            seau,
+            SUM(nombre)
+        FROM ({seaux}) AS seaux
+        GROUP BY GROUPING SETS ((colonne, type_local, seau), (colonne, seau))
+        HAVING GROUPING(type_local) = 1 OR type_local IS NOT NULL
+    """
+    )
+
+    start_time = time.time()
+    try:
+        with param["engine"].connect() as conn:
+            lignes = conn.execute(query_agregats, params).fetchall()
+            lignes_sketchs = conn.execute(query_sketchs, params).fetchall()
+    except Exception as e:
+        param["logger"].error(f"Erreur lors de l'agrégation par le cube: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erreur lors de la recherche dans la base de données : {e}",
+        )
+
+    # Sketchs par (colonne, type de bien), type None pour l'ensemble
+    sketches = {}
+    for colonne, type_local, seau, nombre in lignes_sketchs:
+        sketch = sketches.setdefault((colonne, type_local), SketchQuantiles())
+        sketch.compteurs[seau] = int(nombre)
+    fractions = [p / 100 for p in PERCENTILES]
+
+    def _quantiles(colonne, type_local):
+        return sketches.get((colonne, type_local), SketchQuantiles()).quantiles(
+            fractions
+        )
+
+    statistiques = StatistiquesBiens.depuis_lignes(
+        (
+            type_local,
+            nombre,
+            prix_moyen,
+            prix_min,
+            prix_max,
+            _quantiles("prix_m2", type_local),
+            surface_moyenne,
+            pieces_moyen,
+            distance_max,
+            _quantiles("surface_reelle_bati", type_local),
+        )
+        for (
+            type_local,
+            nombre,
+            prix_moyen,
+            prix_min,
+            prix_max,
+            surface_moyenne,
+            pieces_moyen,
+            distance_max,
+        ) in lignes
+    )
+
+    stats = {**statistiques.globales(), "quantiles_approches": True}
+    param["logger"].info(
+        f"Agrégation par le cube exécutée en {time.time() - start_time:.2f}s, "
+        f"{stats['nb_biens']} biens dans le rayon ({len(interieures)} tuiles "
+        f"intérieures, {len(bord)} tuiles de bord)"
+    )
+    return {"stats": stats, "stats_per_type": statistiques.par_type()}
@@ -0,0 +1,88 @@
+import json
+from typing import List, Dict, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:  # dépendance optionnelle
+    msgpack = None
+
+
+# Formats de réponse proposés par /biens_proches
+MEDIA_JSON = "application/json"
+MEDIA_COLONNES = "application/vnd.proximmo.colonnes+json"
+MEDIA_MSGPACK = "application/x-msgpack"
+
+FORMATS = {"json": MEDIA_JSON, "colonnes": MEDIA_COLONNES, "msgpack": MEDIA_MSGPACK}
+
+
+def negocier_format(accept: Optional[str], format_demande: Optional[str]) -> str:
+    """
+    Choisit le format de réponse : paramètre `format` explicite, sinon en-tête
+    Accept, sinon JSON. MessagePack n'est proposé que si `msgpack` est
+    installé : demandé explicitement (ou seul format accepté) sans l'être,
+    la requête reçoit 406 plutôt qu'un autre format.
+
+    :return: "json", "colonnes" ou "msgpack"
+    """
+    disponibles = {
+        nom: media
+        for nom, media in FORMATS.items()
+        if nom != "msgpack" or msgpack is not None
+    }
+    if format_demande in FORMATS:
+        if format_demande not in disponibles:
+            raise HTTPException(
+                status_code=406,
+                detail=f"Format {format_demande} indisponible (paquet msgpack absent)",
+            )
+        return format_demande
+
+    medias = [m.split(";")[0].strip() for m in (accept or "").split(",")]
+    choix = next(
+        (nom for m in medias for nom, media in disponibles.items() if m == media),
+        None,
+    )
+    if choix is None:
+        acceptes = [m for m in medias if m]
+        if acceptes and all(m == MEDIA_MSGPACK for m in acceptes):
+            raise HTTPException(
+                status_code=406,
+                detail="Format msgpack indisponible (paquet msgpack absent)",
+            )
+        choix = "json"
+    return choix
+
+
+def en_colonnes(biens: List[Dict], champs: Sequence[str]) -> Dict[str, list]:
+    """Liste de biens -> dictionnaire {champ: liste de valeurs}"""
+    return {champ: [b[champ] for b in biens] for champ in champs}
+
+
+def reponse_biens(corps: dict, format_reponse: str, champs: Sequence[str]) -> Response:
+    """
+    Réponse de /biens_proches dans le format négocié. Pour les formats
+    colonnes et MessagePack, `biens_proches` est transposé en colonnes.
+
+    :param corps: Corps de la réponse, `biens_proches` étant une liste de biens
+    :param format_reponse: Format retourné par `negocier_format`
+    :param champs: Champs d'un bien, dans l'ordre des colonnes
+    """
+    entetes = {"Vary": "Accept"}
+    if format_reponse == "json":
+        return JSONResponse(corps, headers=entetes)
+
+    corps = dict(corps, biens_proches=en_colonnes(corps["biens_proches"], champs))
+    if format_reponse == "msgpack":
+        return Response(
+            msgpack.packb(corps, use_bin_type=True),
+            media_type=MEDIA_MSGPACK,
+            headers=entetes,
+        )
+    return Response(
+        json.dumps(corps, ensure_ascii=False, separators=(",", ":")),
+        media_type=MEDIA_COLONNES,
+        headers=entetes,
+    )
@@ -1,30 +1,85 @@
+import asyncio
+from contextlib import nullcontext
+import httpx
 import requests
-from math import radians, sin, cos, sqrt, atan2
+from math import radians, degrees, sin, cos, sqrt, atan2
+import numpy as np
 from sqlalchemy import text
 import time
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from fastapi import HTTPException
+from core.tuiles import plages_tuiles
+from core.stat_compute import PERCENTILES, StatistiquesBiens, calculer_statistiques
 
 
-def geocode_ban(adresse: str):
+# Table des ventes de toutes les années, partitionnée par année (`annee`)
+TABLE_BIENS = "valeurs_foncieres_idf"
+
+# Colonnes lues pour chaque bien, dans l'ordre de la requête
+COLONNES_BIENS = (
+    "latitude",
+    "longitude",
+    "prix_m2",
+    "type_local",
+    "date_mutation",
+    "annee",
+    "surface_reelle_bati",
+    "id_mutation",
+    "nombre_pieces_principales",
+    "adresse",
+)
+
+# Champs de chaque bien retourné
+CHAMPS_BIENS = COLONNES_BIENS + ("distance_m",)
+
+# Nombre maximum de biens retournés par une recherche (les statistiques
+# portent, elles, sur toutes les ventes du rayon)
+LIMITE_BIENS = 1000
+
+RAYON_TERRE_M = 6371000
+
+# Distance haversine (en mètres) entre chaque vente et le point (:lat, :lon),
+# évaluée par la base
+DISTANCE_SQL = f"""
+    2 * {RAYON_TERRE_M} * ASIN(SQRT(
+        POWER(SIN(RADIANS(latitude - :lat) / 2), 2)
+        + COS(RADIANS(:lat)) * COS(RADIANS(latitude))
+        * POWER(SIN(RADIANS(longitude - :lon) / 2), 2)
+    ))
+"""
+
+
+URL_BAN = "https://api-adresse.data.gouv.fr/search/"
+
+
+def _coordonnees_ban(data: dict, adresse: str):
+    """Extrait (latitude, longitude) d'une réponse BAN, (None, None) si vide"""
+    if data.get("features"):
+        coords = data["features"][0]["geometry"]["coordinates"]
+        return coords[1], coords[0]  # lat, lon
+    else:
+        print(f"Adresse introuvable : {adresse}")
+        return None, None
+
+
+def geocode_ban(adresse: str, geocodeur_local=None):
     """
     Géocode une adresse via l'API BAN.
     Retourne (latitude, longitude) ou (None, None) en cas d'erreur.
+
+    :param geocodeur_local: `GeocodeurLocal` optionnel, consulté avant l'API
     """
-    url = "https://api-adresse.data.gouv.fr/search/"
+    if geocodeur_local is not None:
+        coords = geocodeur_local.geocoder(adresse)
+        if coords is not None:
+            return coords
+
     params = {"q": adresse, "limit": 1}
 
     try:
-        response = requests.get(url, params=params, timeout=5)
+        response = requests.get(URL_BAN, params=params, timeout=5)
         response.raise_for_status()
-        data = response.json()
-
-        if data.get("features"):
-            coords = data["features"][0]["geometry"]["coordinates"]
-            return coords[1], coords[0]  # lat, lon
-        else:
-            print(f"Adresse introuvable : {adresse}")
-            return None, None
+        return _coordonnees_ban(response.json(), adresse)
 
     except requests.RequestException as e:
         print(f"Erreur réseau lors de la requête de géocodage : {e}")
@@ -37,6 +92,68 @@ def geocode_ban(adresse: str):
         return None, None
 
 
+def creer_client_ban(
+    max_connexions: int = 20, timeout_s: float = 5.0
+) -> httpx.AsyncClient:
+    """
+    Client HTTP asynchrone pour l'API BAN, avec connexions persistantes
+    (keep-alive) réutilisées d'un appel à l'autre.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connexions,
+            max_keepalive_connections=max_connexions,
+        ),
+        timeout=httpx.Timeout(timeout_s, connect=2.0),
+    )
+
+
+async def geocode_ban_async(
+    adresse: str,
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore = None,
+    timeout_s: float = None,
+    lever_erreurs_reseau: bool = False,
+    geocodeur_local=None,
+):
+    """
+    Version asynchrone de `geocode_ban`, sur un client partagé.
+    Retourne (latitude, longitude) ou (None, None) en cas d'erreur.
+
+    :param client: Client créé par `creer_client_ban`
+    :param semaphore: Limite optionnelle du nombre d'appels simultanés
+    :param timeout_s: Timeout de l'appel (celui du client par défaut)
+    :param lever_erreurs_reseau: Propager les erreurs réseau au lieu de
+        retourner (None, None), pour les distinguer d'une adresse introuvable
+    :param geocodeur_local: `GeocodeurLocal` optionnel, consulté avant l'API
+    """
+    if geocodeur_local is not None:
+        coords = geocodeur_local.geocoder(adresse)
+        if coords is not None:
+            return coords
+
+    params = {"q": adresse, "limit": 1}
+    options = {"timeout": timeout_s} if timeout_s is not None else {}
+
+    try:
+        async with semaphore or nullcontext():
+            response = await client.get(URL_BAN, params=params, **options)
+        response.raise_for_status()
+        return _coordonnees_ban(response.json(), adresse)
+
+    except httpx.HTTPError as e:
+        print(f"Erreur réseau lors de la requête de géocodage : {e}")
+        if lever_erreurs_reseau:
+            raise
+        return None, None
+    except ValueError as e:
+        print(f"Erreur de parsing JSON : {e}")
+        return None, None
+    except (KeyError, IndexError) as e:
+        print(f"Structure inattendue dans la réponse API : {e}")
+        return None, None
+
+
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
     Calcule la distance en mètres entre deux points (Haversine).
@@ -55,75 +172,207 @@ def haversine_distance(lat1, lon1, lat2, lon2):
         return None
 
 
+def haversine_distance_batch(lat1, lon1, lat2, lon2):
+    """
+    Version vectorisée de `haversine_distance` : distances en mètres entre un
+    point (ou un tableau de points) et un tableau de points.
+    """
+    R = 6371000  # rayon Terre en mètres
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2, dtype=np.float64) - lon1)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * R * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
 
-def get_biens_proches(lat: float, lon: float, rayon_m: int, param: dict) -> List[Dict]:
+
+def boite_englobante(lat: float, lon: float, rayon_m: float) -> Dict[str, float]:
     """
-    Récupération optimisée des biens avec filtrage géographique SQL
+    Boîte englobante du cercle de rayon `rayon_m` autour de (lat, lon).
+    L'écart en longitude est corrigé par le cosinus de la latitude.
+
+    :return: Dictionnaire {lat_min, lat_max, lon_min, lon_max}
     """
-    # Conversion du rayon en degrés approximatifs pour le pré-filtrage SQL
-    # 1 degré ≈ 111 km, donc 1 km ≈ 0.009 degré
-    rayon_deg = (rayon_m / 1000) * 0.009
+    dlat = degrees(rayon_m / RAYON_TERRE_M)
+    dlon = dlat / cos(radians(lat))
+    return {
+        "lat_min": lat - dlat,
+        "lat_max": lat + dlat,
+        "lon_min": lon - dlon,
+        "lon_max": lon + dlon,
+    }
 
-    # Requête optimisée avec pré-filtrage géographique
-    query = text(
-        """
-        SELECT 
-            latitude, longitude, prix_m2, type_local, 
-            date_mutation, surface_reelle_bati, id_mutation, 
-            nombre_pieces_principales, adresse
-        FROM valeurs_foncieres_idf_2024
-        WHERE 
-            latitude BETWEEN :lat_min AND :lat_max
-            AND longitude BETWEEN :lon_min AND :lon_max
-        ORDER BY 
-            (latitude - :lat) * (latitude - :lat) + (longitude - :lon) * (longitude - :lon)
-        LIMIT 1000
+
+def filtre_tuiles(boite: Dict[str, float]) -> Tuple[str, Dict[str, int]]:
+    """
+    Condition SQL limitant la recherche aux tuiles qui couvrent la boîte :
+    une plage de clés (parcours d'index B-tree) par ligne de tuiles.
+
+    :param boite: Boîte englobante (voir `boite_englobante`)
+    :return: (condition SQL, paramètres associés)
+    """
+    conditions = []
+    params = {}
+    for i, (debut, fin) in enumerate(plages_tuiles(**boite)):
+        conditions.append(f"tuile BETWEEN :tuile_{i}_debut AND :tuile_{i}_fin")
+        params[f"tuile_{i}_debut"] = debut
+        params[f"tuile_{i}_fin"] = fin
+    return "(" + " OR ".join(conditions) + ")", params
+
+
+def filtre_annees(
+    annee_min: Optional[int] = None, annee_max: Optional[int] = None
+) -> Tuple[str, Dict[str, int]]:
+    """
+    Condition SQL sur la clé de partition `annee` (chaîne vide sans borne) :
+    la base n'ouvre que les partitions des années demandées.
+
+    :return: (condition SQL préfixée par AND, paramètres associés)
+    """
+    conditions = []
+    params = {}
+    if annee_min is not None:
+        conditions.append("annee >= :annee_min")
+        params["annee_min"] = annee_min
+    if annee_max is not None:
+        conditions.append("annee <= :annee_max")
+        params["annee_max"] = annee_max
+    return "".join(f" AND {c}" for c in conditions), params
+
+
+def _colonnes_vers_biens(
+    colonnes: dict, lat: float, lon: float, rayon_m: int
+) -> List[Dict]:
+    """
+    Filtre exact par distance et tri des candidats, en une passe vectorisée.
+
+    :param colonnes: Dictionnaire {colonne: séquence de valeurs} des candidats
+    :return: Liste des biens dans le rayon, triés par distance
     """
+    distances = haversine_distance_batch(
+        lat, lon, colonnes["latitude"], colonnes["longitude"]
     )
+    dans_rayon = np.flatnonzero(distances <= rayon_m)
+    # Tri sur les distances exactes (seule `distance_m` est arrondie) : la
+    # liste reste triée pour la recherche dichotomique du cache des biens,
+    # quel que soit l'ordre des candidats du moteur. Tri stable : à distance
+    # égale, l'ordre des candidats est conservé
+    ordre = dans_rayon[np.argsort(distances[dans_rayon], kind="stable")]
+
+    def _colonne(nom, dtype=object):
+        return np.asarray(colonnes[nom], dtype=dtype)[ordre]
+
+    valeurs = {
+        "latitude": _colonne("latitude", np.float64),
+        "longitude": _colonne("longitude", np.float64),
+        "prix_m2": _colonne("prix_m2", np.float64),
+        "type_local": _colonne("type_local"),
+        "date_mutation": _colonne("date_mutation"),
+        "annee": _colonne("annee", np.float64).astype(np.int64),
+        "surface_reelle_bati": _colonne("surface_reelle_bati", np.float64),
+        "id_mutation": _colonne("id_mutation"),
+        "nombre_pieces_principales": _colonne(
+            "nombre_pieces_principales", np.float64
+        ).astype(np.int64),
+        "adresse": _colonne("adresse").astype(str),
+        "distance_m": np.round(distances[ordre], 1),
+    }
+    noms = list(valeurs)
+    return [
+        dict(zip(noms, ligne))
+        for ligne in zip(*(valeurs[nom].tolist() for nom in noms))
+    ]
+
+
+def _requete_rayon(
+    lat: float,
+    lon: float,
+    rayon_m: int,
+    annee_min: Optional[int] = None,
+    annee_max: Optional[int] = None,
+) -> Tuple[str, dict]:
+    """
+    Sous-requête SQL des ventes situées dans le rayon, avec leur distance
+    `distance_m`. La boîte englobante sert au pré-filtrage par l'index sur
+    la clé de tuile, le test exact du cercle est évalué par la base. Les
+    bornes d'années limitent la lecture aux partitions concernées.
+
+    :return: (sous-requête SQL, paramètres associés)
+    """
+    boite = boite_englobante(lat, lon, rayon_m)
+    condition_tuiles, params_tuiles = filtre_tuiles(boite)
+    condition_annees, params_annees = filtre_annees(annee_min, annee_max)
+
+    sous_requete = f"""
+        SELECT *
+        FROM (
+            SELECT {", ".join(COLONNES_BIENS)}, {DISTANCE_SQL} AS distance_m
+            FROM {TABLE_BIENS}
+            WHERE 
+                {condition_tuiles}
+                AND latitude BETWEEN :lat_min AND :lat_max
+                AND longitude BETWEEN :lon_min AND :lon_max{condition_annees}
+        ) AS candidats
+        WHERE distance_m <= :rayon_m
+    """
     params = {
         "lat": lat,
         "lon": lon,
-        "lat_min": lat - rayon_deg,
-        "lat_max": lat + rayon_deg,
-        "lon_min": lon - rayon_deg,
-        "lon_max": lon + rayon_deg,
+        "rayon_m": rayon_m,
+        **boite,
+        **params_tuiles,
+        **params_annees,
     }
+    return sous_requete, params
+
+
+def get_biens_proches(
+    lat: float,
+    lon: float,
+    rayon_m: int,
+    param: dict,
+    annee_min: Optional[int] = None,
+    annee_max: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Récupération optimisée des biens avec filtrage géographique SQL.
+    Seuls les biens dans le rayon sont transférés, et `ORDER BY`/`LIMIT`
+    s'appliquent aux vrais résultats (les `LIMITE_BIENS` plus proches).
+    Les lignes sont lues par l'index sur la clé de tuile.
+
+    :param annee_min: Première année des ventes (toutes par défaut)
+    :param annee_max: Dernière année des ventes (toutes par défaut)
+    """
+    sous_requete, params = _requete_rayon(lat, lon, rayon_m, annee_min, annee_max)
+    query = text(
+        f"""
+        SELECT {", ".join(COLONNES_BIENS)}
+        FROM ({sous_requete}) AS dans_rayon
+        ORDER BY distance_m
+        LIMIT {LIMITE_BIENS}
+    """
+    )
 
-    biens = []
     start_time = time.time()
+    index_spatial = param.get("index_spatial")
 
     try:
-        with param["engine"].connect() as conn:
-            results = conn.execute(query, params)
-
-            # Traitement des résultats avec calcul exact de distance
-            for row in results:
-                distance = haversine_distance(lat, lon, row.latitude, row.longitude)
-
-                if distance <= rayon_m:
-                    biens.append(
-                        {
-                            "latitude": float(row.latitude),
-                            "longitude": float(row.longitude),
-                            "prix_m2": float(row.prix_m2),
-                            "type_local": row.type_local,
-                            "date_mutation": row.date_mutation,
-                            "surface_reelle_bati": float(row.surface_reelle_bati),
-                            "id_mutation": row.id_mutation,
-                            "nombre_pieces_principales": int(
-                                row.nombre_pieces_principales
-                            ),
-                            "adresse": str(row.adresse),
-                            "distance_m": round(distance, 1),
-                        }
-                    )
-
-            # Tri par distance
-            biens.sort(key=lambda x: x["distance_m"])
+        if index_spatial is not None:
+            # Moteur local (mémoire ou DuckDB) : même sélection que la requête SQL
+            colonnes = index_spatial.candidats(params, LIMITE_BIENS)
+        else:
+            with param["engine"].connect() as conn:
+                lignes = conn.execute(query, params).fetchall()
+            # Lecture des candidats par colonnes
+            colonnes = dict(zip(COLONNES_BIENS, zip(*lignes))) if lignes else {}
+
+        # Calcul exact de distance, filtrage et tri vectorisés
+        biens = _colonnes_vers_biens(colonnes, lat, lon, rayon_m) if colonnes else []
 
         query_time = time.time() - start_time
+        moteur = index_spatial.NOM if index_spatial is not None else "DB"
         param["logger"].info(
-            f"Requête DB exécutée en {query_time:.2f}s, {len(biens)} biens trouvés"
+            f"Requête {moteur} exécutée en {query_time:.2f}s, {len(biens)} biens trouvés"
         )
 
         return biens
@@ -134,3 +383,174 @@ def get_biens_proches(lat: float, lon: float, rayon_m: int, param: dict) -> List
             status_code=500,
             detail=f"Erreur lors de la recherche dans la base de données : {e}",
         )
+
+
+def get_stats_proches(
+    lat: float,
+    lon: float,
+    rayon_m: int,
+    param: dict,
+    annee_min: Optional[int] = None,
+    annee_max: Optional[int] = None,
+) -> Dict:
+    """
+    Statistiques de toutes les ventes du rayon, sans la limite appliquée à
+    la liste des biens : agrégats SQL par type et pour l'ensemble (GROUPING
+    SETS), ou moteur de statistiques groupées sur l'index spatial en mémoire.
+
+    :return: {"stats": statistiques globales, "stats_per_type": statistiques par
+        type}, `stats["quantiles_approches"]` valant False (médianes exactes)
+    """
+    sous_requete, params = _requete_rayon(lat, lon, rayon_m, annee_min, annee_max)
+    fractions = ", ".join(str(p / 100) for p in PERCENTILES)
+    query = text(
+        f"""
+        SELECT
+            CASE WHEN GROUPING(type_local) = 0 THEN type_local END AS type_local,
+            COUNT(*) AS nombre,
+            AVG(prix_m2) AS prix_m2_moyen,
+            MIN(prix_m2) AS prix_m2_min,
+            MAX(prix_m2) AS prix_m2_max,
+            PERCENTILE_CONT(ARRAY[{fractions}]) WITHIN GROUP (ORDER BY prix_m2)
+                AS prix_m2_percentiles,
+            AVG(surface_reelle_bati) AS surface_moyenne,
+            AVG(nombre_pieces_principales) AS nombre_pieces_moyen,
+            MAX(distance_m) AS distance_max,
+            PERCENTILE_CONT(ARRAY[{fractions}])
+                WITHIN GROUP (ORDER BY surface_reelle_bati) AS surface_percentiles
+        FROM ({sous_requete}) AS dans_rayon
+        GROUP BY GROUPING SETS ((type_local), ())
+        HAVING GROUPING(type_local) = 1 OR type_local IS NOT NULL
+    """
+    )
+
+    start_time = time.time()
+    index_spatial = param.get("index_spatial")
+
+    try:
+        if index_spatial is not None:
+            colonnes = index_spatial.candidats(params, limite=None)
+            colonnes["distance_m"] = haversine_distance_batch(
+                lat, lon, colonnes["latitude"], colonnes["longitude"]
+            )
+            statistiques = calculer_statistiques(colonnes, ensemble=True)
+        else:
+            with param["engine"].connect() as conn:
+                lignes = conn.execute(query, params).fetchall()
+            statistiques = StatistiquesBiens.depuis_lignes(lignes)
+    except Exception as e:
+        param["logger"].error(f"Erreur lors de l'agrégation DB: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erreur lors de la recherche dans la base de données : {e}",
+        )
+
+    stats = {**statistiques.globales(), "quantiles_approches": False}
+    moteur = index_spatial.NOM if index_spatial is not None else "DB"
+    param["logger"].info(
+        f"Agrégation {moteur} exécutée en {time.time() - start_time:.2f}s, "
+        f"{stats['nb_biens']} biens dans le rayon"
+    )
+    return {"stats": stats, "stats_per_type": statistiques.par_type()}
+
+
+def _mois(date_mutation) -> str:
+    """Mois (AAAA-MM) d'une date de mutation (date ou texte ISO), None si absente"""
+    return str(date_mutation)[:7] if date_mutation is not None else None
+
+
+def get_tendance(
+    lat: float,
+    lon: float,
+    rayon_m: int,
+    param: dict,
+    annee_min: Optional[int] = None,
+    annee_max: Optional[int] = None,
+) -> Dict:
+    """
+    Évolution mensuelle des prix des ventes du rayon : nombre de ventes,
+    prix au m² moyen et médian par type de bien et par mois, agrégés par la
+    base (ou par le moteur de statistiques groupées sur l'index en mémoire).
+
+    :return: {type_local: [{mois, nombre, prix_m2_moyen, prix_m2_median}, ...]}
+    """
+    sous_requete, params = _requete_rayon(lat, lon, rayon_m, annee_min, annee_max)
+    fractions = ", ".join(str(p / 100) for p in PERCENTILES)
+    query = text(
+        f"""
+        SELECT
+            type_local,
+            LEFT(CAST(date_mutation AS TEXT), 7) AS mois,
+            COUNT(*) AS nombre,
+            AVG(prix_m2) AS prix_m2_moyen,
+            MIN(prix_m2) AS prix_m2_min,
+            MAX(prix_m2) AS prix_m2_max,
+            PERCENTILE_CONT(ARRAY[{fractions}]) WITHIN GROUP (ORDER BY prix_m2)
+                AS prix_m2_percentiles
+        FROM ({sous_requete}) AS dans_rayon
+        WHERE type_local IS NOT NULL AND date_mutation IS NOT NULL
+        GROUP BY type_local, mois
+    """
+    )
+
+    start_time = time.time()
+    index_spatial = param.get("index_spatial")
+
+    try:
+        if index_spatial is not None:
+            colonnes = index_spatial.candidats(params, limite=None)
+            groupes = [
+                (t, _mois(d)) if t and d is not None else None
+                for t, d in zip(
+                    colonnes["type_local"].tolist(), colonnes["date_mutation"].tolist()
+                )
+            ]
+            statistiques = calculer_statistiques(colonnes, groupes=groupes)
+        else:
+            with param["engine"].connect() as conn:
+                lignes = conn.execute(query, params).fetchall()
+            # Groupes (type, mois) ; surface, pièces et distance non calculées
+            statistiques = StatistiquesBiens.depuis_lignes(
+                ((type_local, mois), *agregats, None, None, None)
+                for type_local, mois, *agregats in lignes
+            )
+    except Exception as e:
+        param["logger"].error(f"Erreur lors de l'agrégation mensuelle DB: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erreur lors de la recherche dans la base de données : {e}",
+        )
+
+    moteur = index_spatial.NOM if index_spatial is not None else "DB"
+    param["logger"].info(
+        f"Tendance {moteur} calculée en {time.time() - start_time:.2f}s, "
+        f"{len(statistiques.types)} groupes (type, mois)"
+    )
+    return statistiques.series_mensuelles()
+
+
+def get_annees(param: dict) -> Optional[Tuple[int, int]]:
+    """
+    Première et dernière années des ventes disponibles (années ingérées par
+    le dataset builder, voir DVF_ANNEES), bornes du filtre par années.
+
+    :return: (annee_min, annee_max), None si aucune vente
+    """
+    index_spatial = param.get("index_spatial")
+    try:
+        if index_spatial is not None:
+            return index_spatial.bornes_annees()
+        # Lu sur l'index d'unicité des ventes, qui commence par l'année
+        with param["engine"].connect() as conn:
+            annee_min, annee_max = conn.execute(
+                text(f"SELECT MIN(annee), MAX(annee) FROM {TABLE_BIENS}")
+            ).fetchone()
+    except Exception as e:
+        param["logger"].error(f"Erreur lors de la lecture des années DB: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erreur lors de la recherche dans la base de données : {e}",
+        )
+    if annee_min is None:
+        return None
+    return int(annee_min), int(annee_max)
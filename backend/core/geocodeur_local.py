@@ -0,0 +1,165 @@
+import re
+import time
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from core.cache_geocodage import normaliser_adresse
+
+
+TABLE_ADRESSES = "adresses_idf"
+
+# Mentions ignorées dans le contexte (commune) d'une adresse saisie
+MENTIONS_IGNOREES = re.compile(r"\b(ile de france|idf|france)\b")
+
+# Nombre minimum de mots pour reconnaître une adresse (numéro + voie)
+MOTS_MIN_VOIE = 2
+
+
+class GeocodeurLocal:
+    """
+    Géocodeur hors ligne construit à partir des adresses des ventes DVF.
+
+    Les adresses (numéro et voie) sont normalisées comme les clés du cache
+    de géocodage. Une adresse saisie est reconnue si son début correspond à
+    une adresse connue ; le code postal ou la commune éventuellement saisis
+    servent à lever les ambiguïtés. Sans réponse unique, le géocodage est
+    laissé à l'API BAN.
+
+    Un index de préfixes (liste triée des formes normalisées des adresses,
+    voies et communes) sert l'autocomplétion par recherche dichotomique.
+    """
+
+    def __init__(self, lignes):
+        """
+        :param lignes: Séquence de (adresse, code_postal, nom_commune, latitude, longitude)
+        """
+        self.index = {}
+        codes_postaux, communes, latitudes, longitudes = [], [], [], []
+        # Suggestions : forme normalisée -> [libellé, type, somme lat, somme lon, n]
+        suggestions = {}
+
+        def _ajouter_suggestion(libelle, type_suggestion, lat, lon):
+            entree = suggestions.setdefault(
+                normaliser_adresse(libelle), [libelle, type_suggestion, 0.0, 0.0, 0]
+            )
+            entree[2] += lat
+            entree[3] += lon
+            entree[4] += 1
+
+        for i, (adresse, code_postal, commune, lat, lon) in enumerate(lignes):
+            self.index.setdefault(normaliser_adresse(adresse), []).append(i)
+            code_postal = f"{int(code_postal):05d}"
+            codes_postaux.append(code_postal)
+            communes.append(normaliser_adresse(commune or ""))
+            latitudes.append(lat)
+            longitudes.append(lon)
+
+            localite = f"{code_postal} {commune or ''}".strip()
+            _ajouter_suggestion(f"{adresse} {localite}", "adresse", lat, lon)
+            numero, _, voie = adresse.partition(" ")
+            if numero.isdigit() and voie:
+                _ajouter_suggestion(f"{voie} {localite}", "voie", lat, lon)
+            if commune:
+                _ajouter_suggestion(f"{commune} {code_postal}", "commune", lat, lon)
+
+        self.codes_postaux = np.array(codes_postaux)
+        self.communes = np.array(communes, dtype=object)
+        self.latitude = np.array(latitudes, dtype=np.float64)
+        self.longitude = np.array(longitudes, dtype=np.float64)
+
+        self.cles_prefixes = sorted(suggestions)
+        self.suggestions = [
+            {
+                "libelle": libelle,
+                "type": type_suggestion,
+                "latitude": round(somme_lat / n, 6),
+                "longitude": round(somme_lon / n, 6),
+            }
+            for libelle, type_suggestion, somme_lat, somme_lon, n in (
+                suggestions[cle] for cle in self.cles_prefixes
+            )
+        ]
+
+    def __len__(self):
+        return len(self.latitude)
+
+    @classmethod
+    def depuis_base(cls, engine, table: str = TABLE_ADRESSES, logger=None):
+        """
+        Charge le répertoire d'adresses produit par le dataset builder.
+
+        :param engine: Engine SQLAlchemy
+        :param table: Table des adresses
+        :param logger: Logger optionnel
+        """
+        start_time = time.time()
+        query = text(
+            f"SELECT adresse, code_postal, nom_commune, latitude, longitude FROM {table}"
+        )
+        with engine.connect() as conn:
+            lignes = conn.execute(query).fetchall()
+
+        geocodeur = cls(lignes)
+        if logger:
+            logger.info(
+                f"Géocodeur local chargé en {time.time() - start_time:.2f}s "
+                f"({len(geocodeur)} adresses)"
+            )
+        return geocodeur
+
+    def geocoder(self, adresse: str) -> Optional[Tuple[float, float]]:
+        """
+        Géocode une adresse saisie librement.
+
+        :return: (latitude, longitude) ou None si l'adresse est inconnue ou ambiguë
+        """
+        mots = normaliser_adresse(adresse).split()
+
+        # Plus long début de l'adresse correspondant à une voie connue
+        for fin in range(len(mots), MOTS_MIN_VOIE - 1, -1):
+            indices = self.index.get(" ".join(mots[:fin]))
+            if indices is not None:
+                contexte = mots[fin:]
+                break
+        else:
+            return None
+
+        indices = np.array(indices)
+        code_postal = next((m for m in contexte if re.fullmatch(r"\d{5}", m)), None)
+        commune = " ".join(m for m in contexte if m != code_postal)
+        commune = " ".join(MENTIONS_IGNOREES.sub(" ", commune).split())
+
+        if code_postal is not None:
+            indices = indices[self.codes_postaux[indices] == code_postal]
+        # Commune saisie : filtre même sur une seule correspondance (une voie
+        # homonyme d'une autre commune n'est pas une réponse, BAN prend le relais)
+        if commune:
+            indices = np.array(
+                [i for i in indices if self.communes[i].startswith(commune)]
+            )
+
+        if len(indices) != 1:
+            return None
+        return float(self.latitude[indices[0]]), float(self.longitude[indices[0]])
+
+    def suggerer(self, saisie: str, limite: int = 10) -> List[dict]:
+        """
+        Suggestions d'adresses, de voies et de communes commençant par la saisie.
+
+        :param saisie: Début d'adresse saisi par l'utilisateur
+        :param limite: Nombre maximum de suggestions
+        :return: Liste de {libelle, type, latitude, longitude}
+        """
+        prefixe = normaliser_adresse(saisie)
+        if not prefixe:
+            return []
+        debut = bisect_left(self.cles_prefixes, prefixe)
+        resultats = []
+        for i in range(debut, min(debut + limite, len(self.cles_prefixes))):
+            if not self.cles_prefixes[i].startswith(prefixe):
+                break
+            resultats.append(self.suggestions[i])
+        return resultats
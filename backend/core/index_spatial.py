@@ -0,0 +1,174 @@
+import time
+from math import radians, cos
+from typing import Optional, Tuple
+
+import numpy as np
+from sqlalchemy import text
+
+from core.geocod import (
+    COLONNES_BIENS as COLONNES,
+    RAYON_TERRE_M,
+    haversine_distance_batch,
+)
+
+
+# Taille d'une cellule de la grille (en mètres, coordonnées projetées)
+TAILLE_CELLULE_M = 200
+
+
+class IndexSpatial:
+    """
+    Index spatial en mémoire des ventes, sous forme de grille uniforme.
+
+    Les coordonnées sont projetées (équirectangulaire autour de la latitude
+    moyenne du jeu de données) puis les points sont triés par cellule
+    (ligne de grille puis colonne). Chaque ligne de cellules couverte par une
+    recherche correspond ainsi à une seule tranche contiguë des tableaux.
+    """
+
+    NOM = "mémoire"
+
+    def __init__(self, colonnes: dict, taille_cellule_m: float = TAILLE_CELLULE_M):
+        """
+        :param colonnes: Dictionnaire {nom de colonne: séquence de valeurs}
+        :param taille_cellule_m: Côté d'une cellule de la grille en mètres
+        """
+        lat = np.asarray(colonnes["latitude"], dtype=np.float64)
+        lon = np.asarray(colonnes["longitude"], dtype=np.float64)
+
+        self.taille_cellule_m = taille_cellule_m
+        self.cos_lat0 = cos(radians(float(lat.mean()))) if len(lat) else 1.0
+
+        x, y = self._projeter(lat, lon)
+        self.x_min = float(x.min()) if len(x) else 0.0
+        self.y_min = float(y.min()) if len(y) else 0.0
+        ix = ((x - self.x_min) // taille_cellule_m).astype(np.int64)
+        iy = ((y - self.y_min) // taille_cellule_m).astype(np.int64)
+        self.nx = int(ix.max()) + 1 if len(ix) else 1
+        self.ny = int(iy.max()) + 1 if len(iy) else 1
+
+        # Tri des points par cellule puis tableau de décalages (format CSR)
+        cles = iy * self.nx + ix
+        ordre = np.argsort(cles, kind="stable")
+        self.decalages = np.searchsorted(
+            cles[ordre], np.arange(self.nx * self.ny + 1), side="left"
+        )
+
+        self.latitude = lat[ordre]
+        self.longitude = lon[ordre]
+        # Années des ventes, pour filtrer comme la clé de partition SQL
+        self.annees = np.asarray(colonnes["annee"], dtype=np.int64)[ordre]
+        self.colonnes = {
+            nom: np.asarray(colonnes[nom], dtype=object)[ordre]
+            for nom in COLONNES
+            if nom not in ("latitude", "longitude")
+        }
+
+    def __len__(self):
+        return len(self.latitude)
+
+    @classmethod
+    def depuis_base(cls, engine, table: str, logger=None) -> "IndexSpatial":
+        """
+        Charge toute la table des ventes et construit l'index.
+
+        :param engine: Engine SQLAlchemy
+        :param table: Nom de la table des ventes
+        :param logger: Logger optionnel
+        """
+        start_time = time.time()
+        query = text(f"SELECT {', '.join(COLONNES)} FROM {table}")
+
+        with engine.connect() as conn:
+            lignes = conn.execute(query).fetchall()
+
+        colonnes = {
+            nom: [ligne[i] for ligne in lignes] for i, nom in enumerate(COLONNES)
+        }
+        index = cls(colonnes)
+
+        if logger:
+            logger.info(
+                f"Index spatial chargé en {time.time() - start_time:.2f}s "
+                f"({len(index)} biens, grille {index.nx}x{index.ny})"
+            )
+        return index
+
+    def _projeter(self, lat, lon):
+        """Projection équirectangulaire en mètres"""
+        x = RAYON_TERRE_M * np.radians(lon) * self.cos_lat0
+        y = RAYON_TERRE_M * np.radians(lat)
+        return x, y
+
+    def _indices_boite(self, lat_min, lat_max, lon_min, lon_max) -> np.ndarray:
+        """Indices des points situés dans la boîte (bornes incluses)"""
+        x0, y0 = self._projeter(lat_min, lon_min)
+        x1, y1 = self._projeter(lat_max, lon_max)
+        ix0 = max(int((x0 - self.x_min) // self.taille_cellule_m), 0)
+        ix1 = min(int((x1 - self.x_min) // self.taille_cellule_m), self.nx - 1)
+        iy0 = max(int((y0 - self.y_min) // self.taille_cellule_m), 0)
+        iy1 = min(int((y1 - self.y_min) // self.taille_cellule_m), self.ny - 1)
+
+        if ix0 > ix1 or iy0 > iy1:
+            return np.empty(0, dtype=np.int64)
+
+        tranches = [
+            np.arange(
+                self.decalages[iy * self.nx + ix0],
+                self.decalages[iy * self.nx + ix1 + 1],
+            )
+            for iy in range(iy0, iy1 + 1)
+        ]
+        indices = np.concatenate(tranches)
+
+        # Filtrage exact sur la boîte (les cellules débordent de la boîte)
+        lat = self.latitude[indices]
+        lon = self.longitude[indices]
+        masque = (
+            (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        )
+        return indices[masque]
+
+    def bornes_annees(self) -> Optional[Tuple[int, int]]:
+        """Première et dernière années des ventes, None si l'index est vide"""
+        if not len(self.annees):
+            return None
+        return int(self.annees.min()), int(self.annees.max())
+
+    def candidats(self, params: dict, limite: Optional[int] = 1000) -> dict:
+        """
+        Équivalent en mémoire de la requête SQL : points de la boîte
+        englobante situés dans le rayon, triés par distance et limités à
+        `limite` lignes.
+
+        :param params: Mêmes paramètres que la requête SQL (lat, lon, rayon_m,
+            bornes, annee_min et annee_max optionnelles)
+        :param limite: Nombre maximum de candidats (None : tous les points du rayon)
+        :return: Dictionnaire {colonne: tableau numpy} des candidats
+        """
+        indices = self._indices_boite(
+            params["lat_min"], params["lat_max"], params["lon_min"], params["lon_max"]
+        )
+        distances = haversine_distance_batch(
+            params["lat"],
+            params["lon"],
+            self.latitude[indices],
+            self.longitude[indices],
+        )
+        dans_rayon = distances <= params["rayon_m"]
+        if "annee_min" in params:
+            dans_rayon &= self.annees[indices] >= params["annee_min"]
+        if "annee_max" in params:
+            dans_rayon &= self.annees[indices] <= params["annee_max"]
+        indices, distances = indices[dans_rayon], distances[dans_rayon]
+        if limite is not None and len(indices) > limite:
+            plus_proches = np.argpartition(distances, limite - 1)[:limite]
+            indices, distances = indices[plus_proches], distances[plus_proches]
+        indices = indices[np.argsort(distances, kind="stable")]
+
+        colonnes = {
+            "latitude": self.latitude[indices],
+            "longitude": self.longitude[indices],
+        }
+        colonnes.update({nom: col[indices] for nom, col in self.colonnes.items()})
+        return colonnes
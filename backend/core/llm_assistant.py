@@ -1,34 +1,45 @@
-from together import Together
-from typing import AsyncGenerator
+from together import AsyncTogether, Together
+from typing import AsyncGenerator, Optional
 import asyncio
-from core.stat_compute import (
-    prix_m2_moyen_par_type,
-    prix_m2_max_par_type,
-    prix_m2_min_par_type,
-    surface_moyenne_par_type,
-    nombre_pieces_moyen_par_type,
-    nombre_biens_par_type,
-)
+from core.stat_compute import calculer_statistiques
 
 
-def analyse_biens_par_llm(biens: list[dict], rayon_m: int, param: dict) -> str:
+def stats_pour_prompt(biens: list[dict], stats_per_type: Optional[dict] = None) -> dict:
+    """
+    Statistiques par type utilisées dans le prompt. Les agrégats de toutes
+    les ventes du rayon (`stats_per_type` retourné par `get_stats_proches`)
+    sont préférés ; à défaut, elles sont calculées sur la liste `biens`.
+    """
+    if stats_per_type is None:
+        stats_per_type = calculer_statistiques(biens).par_type()
+    return {
+        "nombre_biens": stats_per_type["nombre_biens_par_type"],
+        "prix_m2_moyen": stats_per_type["prix_m2_moyen_par_type"],
+        "prix_m2_median": stats_per_type.get("prix_m2_median_par_type", {}),
+        "prix_m2_max": stats_per_type["prix_m2_max_par_type"],
+        "prix_m2_min": stats_per_type["prix_m2_min_par_type"],
+        "surface_moyenne": stats_per_type["surface_moyenne_par_type"],
+        "nombre_pieces_moyen": stats_per_type["nombre_pieces_moyen_par_type"],
+    }
+
+
+def analyse_biens_par_llm(
+    biens: list[dict],
+    rayon_m: int,
+    param: dict,
+    stats_per_type: Optional[dict] = None,
+    periode: Optional[str] = None,
+) -> str:
     """
     Version originale non-streaming 
     """
     try:
         client = Together()
         # Calcul des statistiques (logique conservée)
-        stats = {
-            "nombre_biens": nombre_biens_par_type(biens),
-            "prix_m2_moyen": prix_m2_moyen_par_type(biens),
-            "prix_m2_max": prix_m2_max_par_type(biens),
-            "prix_m2_min": prix_m2_min_par_type(biens),
-            "surface_moyenne": surface_moyenne_par_type(biens),
-            "nombre_pieces_moyen": nombre_pieces_moyen_par_type(biens),
-        }
+        stats = stats_pour_prompt(biens, stats_per_type)
 
         # Générer le prompt
-        prompt = formater_prompt(stats, rayon_m)
+        prompt = formater_prompt(stats, rayon_m, periode)
 
         response = client.chat.completions.create(
             model="meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
@@ -53,7 +64,11 @@ def analyse_biens_par_llm(biens: list[dict], rayon_m: int, param: dict) -> str:
 
 
 async def analyse_biens_par_llm_stream(
-    biens: list[dict], rayon_m: int, param: dict
+    biens: list[dict],
+    rayon_m: int,
+    param: dict,
+    stats_per_type: Optional[dict] = None,
+    periode: Optional[str] = None,
 ) -> AsyncGenerator[str, None]:
     """
     Version streaming de l'analyse LLM 
@@ -62,30 +77,32 @@ async def analyse_biens_par_llm_stream(
     :param biens: Liste de biens
     :param rayon_m: Rayon choisi en mètres
     :param param: engine et logger
+    :param stats_per_type: Statistiques par type de toutes les ventes du rayon
+        (sinon calculées sur `biens`)
+    :param periode: Période des ventes, rappelée dans le prompt
     :yield: Chunks de texte au fur et à mesure de la génération
+
+    Le client asynchrone de Together est utilisé : l'attente de la réponse
+    et des chunks ne bloque pas la boucle d'événements (ni les autres
+    requêtes, ni les flux SSE en cours).
     """
     try:
         # Calcul des statistiques sur TOUS les biens
-        stats = {
-            "nombre_biens": nombre_biens_par_type(biens),
-            "prix_m2_moyen": prix_m2_moyen_par_type(biens),
-            "prix_m2_max": prix_m2_max_par_type(biens),
-            "prix_m2_min": prix_m2_min_par_type(biens),
-            "surface_moyenne": surface_moyenne_par_type(biens),
-            "nombre_pieces_moyen": nombre_pieces_moyen_par_type(biens),
-        }
+        stats = stats_pour_prompt(biens, stats_per_type)
 
         # Générer le prompt
-        prompt = formater_prompt(stats, rayon_m)
+        prompt = formater_prompt(stats, rayon_m, periode)
 
-        param["logger"].info(f"Analyse streaming démarrée pour {len(biens)} biens")
+        param["logger"].info(
+            f"Analyse streaming démarrée pour {sum(stats['nombre_biens'].values())} biens"
+        )
 
         
         try:
             
-            client = Together()
+            client = AsyncTogether()
 
-            response = client.chat.completions.create(
+            response = await client.chat.completions.create(
                 model="meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
                 messages=[
                     {
@@ -102,7 +119,7 @@ async def analyse_biens_par_llm_stream(
             )
 
             # Streaming des chunks
-            for chunk in response:
+            async for chunk in response:
                 if hasattr(chunk, "choices") and chunk.choices:
                     if hasattr(chunk.choices[0], "delta") and chunk.choices[0].delta:
                         if (
@@ -118,8 +135,8 @@ async def analyse_biens_par_llm_stream(
                 f"Streaming natif indisponible, simulation: {streaming_error}"
             )
 
-            client = Together()
-            response = client.chat.completions.create(
+            client = AsyncTogether()
+            response = await client.chat.completions.create(
                 model="meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
                 messages=[
                     {
@@ -159,15 +176,17 @@ async def analyse_biens_par_llm_stream(
         yield f"\n\n Erreur lors de l'analyse : Analyse indisponible temporairement."
 
 
-def formater_prompt(stats: dict, rayon_m: int) -> str:
+def formater_prompt(stats: dict, rayon_m: int, periode: Optional[str] = None) -> str:
     """
     Formate les stats pour le prompt LLM avec un commentaire factuel détaillé incluant le nombre total de biens et la répartition.
     Si aucun bien n'est trouvé, génère un message simple sans analyse.
 
     :param stats: Stats calculées
     :param rayon_m: Rayon en mètres
+    :param periode: Période des ventes (par exemple "en 2024" ou "entre 2020 et 2024")
     :return: Texte du prompt
     """
+    periode = periode or "sur la période choisie"
     parts = []
     nombre_biens_par_type = stats.get("nombre_biens", {}) or {}
     total_biens = sum(nombre_biens_par_type.values())
@@ -179,18 +198,20 @@ def formater_prompt(stats: dict, rayon_m: int) -> str:
 
     # Stats détaillées
     for t in stats.get("prix_m2_moyen", {}).keys():
+        mediane = stats.get("prix_m2_median", {}).get(t)
         parts.append(
             f"{t} :\n"
             f"- Nombre de biens : {nombre_biens_par_type.get(t, 0)}\n"
             f"- Prix moyen au m² : {round(stats['prix_m2_moyen'].get(t),2)} €\n"
-            f"- Prix max au m² : {round(stats['prix_m2_max'].get(t),2)} €\n"
+            + (f"- Prix médian au m² : {mediane} €\n" if mediane is not None else "")
+            + f"- Prix max au m² : {round(stats['prix_m2_max'].get(t),2)} €\n"
             f"- Prix min au m² : {round(stats['prix_m2_min'].get(t),2)} €\n"
             f"- Surface moyenne : {round(stats['surface_moyenne'].get(t),2)} m²\n"
             f"- Nombre de pièces moyen : {round(stats['nombre_pieces_moyen'].get(t),2)}\n"
         )
 
     return (
-        f"Voici un résumé détaillé des biens vendus dans un rayon de {rayon_m} mètres :\n\n"
+        f"Voici un résumé détaillé des biens vendus {periode} dans un rayon de {rayon_m} mètres :\n\n"
         f"Nombre total de biens : {total_biens}\n"
         f"Répartition par type :\n{repartition}\n\n"
         f"\n".join(parts)
@@ -202,7 +223,7 @@ def formater_prompt(stats: dict, rayon_m: int) -> str:
         "Ne fais strictement aucune comparaison avec d'autres secteurs, périodes, ou autres types de biens. "
         "Traite chaque type de bien comme une analyse isolée et autonome. "
         "Limite-toi à analyser les chiffres de chaque type individuellement et à les expliquer de façon précise et complète. "
-        "Si le nombre de biens est de 0 pour un type, indique qu'il n'y a pas eu de vente de ce type en 2024 dans le rayon choisi et limite-toi à ça.\n\n"
+        f"Si le nombre de biens est de 0 pour un type, indique qu'il n'y a pas eu de vente de ce type {periode} dans le rayon choisi et limite-toi à ça.\n\n"
         "les titres de section ═══ APPARTEMENTS ═══ ou ═══ MAISONS ═══ repectivement pour chaque type de bien  "
         "Rajoute une synthése la fin de l'analyse avec le titre ═══ CONCLUSION ═══ "
     )
@@ -0,0 +1,162 @@
+import re
+import time
+from typing import Optional, Tuple
+
+try:
+    import duckdb
+except ImportError:  # dépendance optionnelle : moteur duckdb indisponible
+    duckdb = None
+
+from core.geocod import (
+    COLONNES_BIENS as COLONNES,
+    DISTANCE_SQL,
+    TABLE_BIENS,
+    filtre_annees,
+    filtre_tuiles,
+)
+
+
+class MoteurDuckDB:
+    """
+    Moteur de recherche local : les ventes sont lues par DuckDB (embarqué)
+    dans le fichier Parquet écrit par le dataset builder, sans base distante.
+
+    Le fichier est trié par tuile : la requête, identique à celle du moteur
+    SQL (plages de tuiles, boîte englobante, années, distance), ne lit que
+    les groupes de lignes dont les statistiques min/max recoupent les tuiles
+    de la recherche. Même interface que `IndexSpatial`.
+    """
+
+    NOM = "DuckDB"
+
+    def __init__(self, chemin: str):
+        """
+        :param chemin: Fichier Parquet des ventes (voir DVF_PARQUET du dataset builder)
+        """
+        if duckdb is None:
+            raise RuntimeError("Le moteur duckdb nécessite le paquet duckdb")
+        self.chemin = chemin
+        self.connexion = duckdb.connect()
+        # Métadonnées du fichier (statistiques des groupes de lignes) gardées
+        # en mémoire entre les requêtes ; relues si le fichier est remplacé
+        self.connexion.execute("SET parquet_metadata_cache = true")
+        # (les vues ne sont pas paramétrables : chemin en littéral SQL)
+        litteral = "'" + chemin.replace("'", "''") + "'"
+        self.connexion.execute(
+            f"CREATE VIEW {TABLE_BIENS} AS SELECT * FROM read_parquet({litteral})"
+        )
+
+    def __len__(self):
+        return self._executer(f"SELECT COUNT(*) FROM {TABLE_BIENS}").fetchone()[0]
+
+    @classmethod
+    def depuis_parquet(cls, chemin: str, logger=None) -> "MoteurDuckDB":
+        """
+        Ouvre le fichier Parquet des ventes.
+
+        :param chemin: Fichier Parquet écrit par le dataset builder
+        :param logger: Logger optionnel
+        """
+        start_time = time.time()
+        moteur = cls(chemin)
+        nombre = len(moteur)
+
+        if logger:
+            logger.info(
+                f"Moteur DuckDB ouvert en {time.time() - start_time:.2f}s "
+                f"({nombre} biens, {chemin})"
+            )
+        return moteur
+
+    def _executer(self, sql: str, params: Optional[dict] = None):
+        """
+        Exécute une requête sur un curseur propre (un par appel : les
+        recherches arrivent de plusieurs threads). Les paramètres nommés
+        `:nom` des requêtes SQLAlchemy deviennent `$nom` pour DuckDB.
+        """
+        sql = re.sub(r"(?<!:):(\w+)", r"$\1", sql)
+        noms = set(re.findall(r"\$(\w+)", sql))
+        curseur = self.connexion.cursor()
+        return curseur.execute(sql, {nom: params[nom] for nom in noms} or None)
+
+    def bornes_annees(self) -> Optional[Tuple[int, int]]:
+        """
+        Première et dernière années des ventes (statistiques min/max des
+        groupes de lignes), None si le fichier est vide
+        """
+        annee_min, annee_max = self._executer(
+            f"SELECT MIN(annee), MAX(annee) FROM {TABLE_BIENS}"
+        ).fetchone()
+        if annee_min is None:
+            return None
+        return int(annee_min), int(annee_max)
+
+    def candidats(self, params: dict, limite: Optional[int] = 1000) -> dict:
+        """
+        Ventes de la boîte englobante situées dans le rayon, triées par
+        distance et limitées à `limite` lignes.
+
+        :param params: Mêmes paramètres que la requête SQL (lat, lon, rayon_m,
+            bornes, annee_min et annee_max optionnelles)
+        :param limite: Nombre maximum de candidats (None : toutes les ventes du rayon)
+        :return: Dictionnaire {colonne: tableau numpy} des candidats
+        """
+        condition_tuiles, _ = filtre_tuiles(
+            {b: params[b] for b in ("lat_min", "lat_max", "lon_min", "lon_max")}
+        )
+        condition_annees, _ = filtre_annees(
+            params.get("annee_min"), params.get("annee_max")
+        )
+        sql = f"""
+            SELECT {", ".join(COLONNES)}
+            FROM (
+                SELECT {", ".join(COLONNES)}, {DISTANCE_SQL} AS distance_m
+                FROM {TABLE_BIENS}
+                WHERE
+                    {condition_tuiles}
+                    AND latitude BETWEEN :lat_min AND :lat_max
+                    AND longitude BETWEEN :lon_min AND :lon_max{condition_annees}
+            ) AS candidats
+            WHERE distance_m <= :rayon_m
+            ORDER BY distance_m
+        """
+        if limite is not None:
+            sql += f" LIMIT {int(limite)}"
+        return self._executer(sql, params).fetchnumpy()
+
+    def version(self, logger=None) -> str:
+        """
+        Version des données écrite par le dataset builder dans les
+        métadonnées du fichier ; à défaut, version propre au démarrage.
+        """
+        version = None
+        try:
+            ligne = self._executer(
+                "SELECT value FROM parquet_kv_metadata(:chemin) "
+                "WHERE CAST(key AS VARCHAR) = 'version'",
+                {"chemin": self.chemin},
+            ).fetchone()
+            if ligne:
+                version = bytes(ligne[0]).decode()
+        except Exception as e:
+            if logger:
+                logger.warning(f"Version des données illisible : {e}")
+        if version is None:
+            version = f"demarrage-{time.time_ns()}"
+        if logger:
+            logger.info(f"Version des données : {version}")
+        return version
+
+    def adresses(self) -> list:
+        """
+        Adresses des ventes et leur position moyenne, au format attendu par
+        `GeocodeurLocal` : (adresse, code postal, commune, latitude, longitude)
+        """
+        return self._executer(
+            f"""
+            SELECT adresse, CAST(code_postal AS INTEGER), nom_commune,
+                AVG(latitude), AVG(longitude)
+            FROM {TABLE_BIENS}
+            GROUP BY adresse, CAST(code_postal AS INTEGER), nom_commune
+            """
+        ).fetchall()
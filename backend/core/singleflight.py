@@ -0,0 +1,123 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Coalescence des appels concurrents identiques : pour une même clé, un
+    seul appel est exécuté à la fois et tous les demandeurs reçoivent son
+    résultat (ou son exception).
+
+    Le travail tourne dans une tâche indépendante : l'annulation d'un
+    demandeur (client déconnecté) n'interrompt pas les autres.
+    """
+
+    def __init__(self):
+        self._en_cours = {}
+        self._flux_en_cours = {}
+        self.appels = 0
+        self.dedupliques = 0
+
+    async def executer(
+        self, cle: Hashable, fabrique: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Exécute `fabrique()` ou attend l'exécution déjà en cours pour `cle`.
+
+        :param cle: Identifiant du travail
+        :param fabrique: Fonction sans argument retournant un awaitable
+        """
+        tache = self._en_cours.get(cle)
+        if tache is None:
+            self.appels += 1
+            tache = asyncio.ensure_future(fabrique())
+            self._en_cours[cle] = tache
+            tache.add_done_callback(lambda t: self._terminer(self._en_cours, cle, t))
+        else:
+            self.dedupliques += 1
+        return await asyncio.shield(tache)
+
+    async def diffuser(
+        self, cle: Hashable, fabrique: Callable[[], AsyncIterator[Any]]
+    ) -> AsyncIterator[Any]:
+        """
+        Version flux de `executer` : un seul générateur asynchrone est consommé
+        par clé et chaque morceau est rediffusé à tous les abonnés, y compris
+        ceux arrivés en cours de route (qui reçoivent d'abord les morceaux déjà
+        produits).
+
+        :param cle: Identifiant du flux
+        :param fabrique: Fonction sans argument retournant un itérateur asynchrone
+        """
+        flux = self._flux_en_cours.get(cle)
+        if flux is None:
+            self.appels += 1
+            flux = _Flux()
+            flux.tache = asyncio.ensure_future(flux.consommer(fabrique()))
+            self._flux_en_cours[cle] = flux
+            flux.tache.add_done_callback(
+                lambda t: self._terminer(self._flux_en_cours, cle, t)
+            )
+        else:
+            self.dedupliques += 1
+
+        async for morceau in flux.lire():
+            yield morceau
+
+    @staticmethod
+    def _terminer(en_cours: dict, cle: Hashable, tache: asyncio.Future) -> None:
+        """Libère la clé et marque l'exception éventuelle comme récupérée"""
+        en_cours.pop(cle, None)
+        if not tache.cancelled():
+            tache.exception()
+
+    def stats(self) -> dict:
+        """Nombre d'exécutions réelles et d'appels dédupliqués"""
+        total = self.appels + self.dedupliques
+        return {
+            "appels": self.appels,
+            "dedupliques": self.dedupliques,
+            "en_cours": len(self._en_cours) + len(self._flux_en_cours),
+            "taux_deduplication": round(self.dedupliques / total, 3) if total else 0.0,
+        }
+
+
+class _Flux:
+    """Morceaux d'un flux partagé et notification des abonnés"""
+
+    def __init__(self):
+        self.morceaux = []
+        self.termine = False
+        self.erreur = None
+        self.tache = None
+        self._condition = asyncio.Condition()
+
+    async def consommer(self, iterateur: AsyncIterator[Any]) -> None:
+        try:
+            async for morceau in iterateur:
+                async with self._condition:
+                    self.morceaux.append(morceau)
+                    self._condition.notify_all()
+        except Exception as e:
+            self.erreur = e
+        finally:
+            async with self._condition:
+                self.termine = True
+                self._condition.notify_all()
+
+    async def lire(self) -> AsyncIterator[Any]:
+        position = 0
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(
+                    lambda: position < len(self.morceaux) or self.termine
+                )
+                nouveaux = self.morceaux[position:]
+                termine = self.termine
+            for morceau in nouveaux:
+                yield morceau
+            position += len(nouveaux)
+            if termine and position >= len(self.morceaux):
+                if self.erreur is not None:
+                    raise self.erreur
+                return
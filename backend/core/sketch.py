@@ -0,0 +1,62 @@
+from math import log
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+
+# Erreur relative maximale des quantiles estimés (1 %)
+PRECISION_RELATIVE = 0.01
+
+
+class SketchQuantiles:
+    """
+    Sketch de quantiles à erreur relative bornée (type DDSketch) pour des
+    valeurs strictement positives (prix au m², surfaces).
+
+    Chaque valeur x est comptée dans le seau i = ceil(ln(x) / ln(gamma)),
+    avec gamma = (1 + a) / (1 - a) : tout quantile est estimé à une erreur
+    relative a près. Deux sketches de même précision se fusionnent en
+    additionnant leurs compteurs, exactement : les sketches partiels du cube
+    (par tuile, type et mois, calculés par le dataset builder) sont
+    additionnés par la base sans relire les ventes.
+    """
+
+    def __init__(
+        self,
+        precision: float = PRECISION_RELATIVE,
+        compteurs: Optional[Dict[int, int]] = None,
+    ):
+        """
+        :param precision: Erreur relative maximale a des quantiles
+        :param compteurs: Compteurs initiaux {indice de seau: nombre de valeurs}
+        """
+        self.precision = precision
+        self.gamma = (1 + precision) / (1 - precision)
+        self.ln_gamma = log(self.gamma)
+        self.compteurs = dict(compteurs or {})
+
+    def __len__(self):
+        return sum(self.compteurs.values())
+
+    def quantiles(self, fractions: Sequence[float]) -> list:
+        """
+        Quantiles estimés, None si le sketch est vide. Comme `np.percentile`
+        et `percentile_cont`, le rang q * (n - 1) est interpolé linéairement
+        entre les valeurs (estimées par leur seau) des deux rangs entiers voisins.
+
+        :param fractions: Fractions entre 0 et 1 (0.5 pour la médiane)
+        """
+        if not self.compteurs:
+            return [None] * len(fractions)
+        indices = np.array(sorted(self.compteurs), dtype=np.int64)
+        cumul = np.cumsum([self.compteurs[i] for i in indices.tolist()])
+        rangs = np.asarray(fractions, dtype=np.float64) * (cumul[-1] - 1)
+
+        def _valeur(rang):
+            seaux = indices[np.searchsorted(cumul, rang, side="right")]
+            # Milieu (en erreur relative) du seau ]gamma^(i-1), gamma^i]
+            return 2 * np.power(self.gamma, seaux.astype(np.float64)) / (self.gamma + 1)
+
+        bas, haut = np.floor(rangs), np.ceil(rangs)
+        valeurs = _valeur(bas) + (_valeur(haut) - _valeur(bas)) * (rangs - bas)
+        return valeurs.tolist()
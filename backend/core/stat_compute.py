@@ -1,114 +1,304 @@
-def prix_m2_moyen_par_type(biens):
-    """
-    Calcule le prix moyen au m² pour chaque type de bien.
+from typing import Dict, List, Optional, Sequence, Union
 
-    :param biens: Liste de dictionnaires contenant les données des biens.
-    :return: Dictionnaire {type_local: prix_m2_moyen arrondi à 3 décimales} ou message d'erreur.
-    """
-    try:
-        stats = {}
-        for b in biens:
-            type_local = b.get("type_local")
-            prix = b.get("prix_m2")
-            if type_local and prix is not None:
-                stats.setdefault(type_local, []).append(prix)
-        return {t: (round(sum(p) / len(p), 3) if p else None) for t, p in stats.items()}
-    except Exception as e:
-        return {"error": f"Erreur dans prix_m2_moyen_par_type: {str(e)}"}
-
-
-def nombre_pieces_moyen_par_type(biens):
-    """
-    Calcule le nombre moyen de pièces principales par type de bien.
+import numpy as np
 
-    :param biens: Liste de dictionnaires contenant les données des biens.
-    :return: Dictionnaire {type_local: nombre_pieces_moyen} ou message d'erreur.
-    """
-    try:
-        stats = {}
-        for b in biens:
-            type_local = b.get("type_local")
-            pieces = b.get("nombre_pieces_principales")
-            if type_local and pieces is not None:
-                stats.setdefault(type_local, []).append(pieces)
-        return {t: (sum(p) / len(p) if p else None) for t, p in stats.items()}
-    except Exception as e:
-        return {"error": f"Erreur dans nombre_pieces_moyen_par_type: {str(e)}"}
-
-
-def prix_m2_min_par_type(biens):
-    """
-    Calcule le prix minimum au m² pour chaque type de bien.
+# Percentiles du prix au m² et de la surface calculés pour chaque type de bien
+PERCENTILES = (10, 25, 50, 75, 90)
 
-    :param biens: Liste de dictionnaires contenant les données des biens.
-    :return: Dictionnaire {type_local: prix_m2_min} ou message d'erreur.
-    """
-    try:
-        stats = {}
-        for b in biens:
-            type_local = b.get("type_local")
-            prix = b.get("prix_m2")
-            if type_local and prix is not None:
-                if type_local not in stats:
-                    stats[type_local] = prix
-                else:
-                    stats[type_local] = min(prix, stats[type_local])
-        return stats
-    except Exception as e:
-        return {"error": f"Erreur dans prix_m2_min_par_type: {str(e)}"}
-
-
-def prix_m2_max_par_type(biens):
-    """
-    Calcule le prix maximum au m² pour chaque type de bien.
+# Colonnes résumées par un sketch de quantiles fusionnable
+COLONNES_SKETCH = ("prix_m2", "surface_reelle_bati")
 
-    :param biens: Liste de dictionnaires contenant les données des biens.
-    :return: Dictionnaire {type_local: prix_m2_max} ou message d'erreur.
-    """
-    try:
-        stats = {}
-        for b in biens:
-            type_local = b.get("type_local")
-            prix = b.get("prix_m2")
-            if type_local and prix is not None:
-                stats[type_local] = max(prix, stats.get(type_local, prix))
-        return stats
-    except Exception as e:
-        return {"error": f"Erreur dans prix_m2_max_par_type: {str(e)}"}
-
-
-def surface_moyenne_par_type(biens):
+
+class StatistiquesBiens:
     """
-    Calcule la surface bâtie moyenne pour chaque type de bien.
+    Statistiques par type de bien, calculées en une seule passe groupée
+    (`calculer_statistiques`) ou lues depuis les agrégats SQL
+    (`depuis_lignes`). Le groupe de type None, s'il existe, porte les
+    statistiques de l'ensemble des biens.
 
-    :param biens: Liste de dictionnaires contenant les données des biens.
-    :return: Dictionnaire {type_local: surface_moyenne} ou message d'erreur.
+    Chaque statistique est un tableau numpy aligné sur `types` (NaN quand
+    aucune valeur n'est renseignée).
     """
-    try:
-        stats = {}
-        for b in biens:
-            type_local = b.get("type_local")
-            surf = b.get("surface_reelle_bati")
-            if type_local and surf is not None:
-                stats.setdefault(type_local, []).append(surf)
-        return {t: (sum(s) / len(s) if s else None) for t, s in stats.items()}
-    except Exception as e:
-        return {"error": f"Erreur dans surface_moyenne_par_type: {str(e)}"}
-
-
-def nombre_biens_par_type(biens):
+
+    def __init__(
+        self,
+        types: Sequence[Optional[str]],
+        nombre: np.ndarray,
+        prix_moyen: np.ndarray,
+        prix_min: np.ndarray,
+        prix_max: np.ndarray,
+        prix_percentiles: np.ndarray,
+        surface_moyenne: np.ndarray,
+        pieces_moyen: np.ndarray,
+        distance_max: Optional[np.ndarray] = None,
+        surface_percentiles: Optional[np.ndarray] = None,
+    ):
+        """
+        :param types: Types de bien (None : ensemble des biens)
+        :param prix_percentiles: Tableau (nombre de types, len(PERCENTILES))
+        :param distance_max: Distance maximale au point de recherche, si connue
+        :param surface_percentiles: Comme `prix_percentiles`, pour la surface, si connus
+        """
+        self.types = list(types)
+        self.nombre = np.asarray(nombre, dtype=np.int64)
+        self.prix_moyen = np.asarray(prix_moyen, dtype=np.float64)
+        self.prix_min = np.asarray(prix_min, dtype=np.float64)
+        self.prix_max = np.asarray(prix_max, dtype=np.float64)
+        self.prix_percentiles = np.asarray(prix_percentiles, dtype=np.float64).reshape(
+            len(self.types), len(PERCENTILES)
+        )
+        self.surface_moyenne = np.asarray(surface_moyenne, dtype=np.float64)
+        self.pieces_moyen = np.asarray(pieces_moyen, dtype=np.float64)
+        self.distance_max = (
+            np.asarray(distance_max, dtype=np.float64)
+            if distance_max is not None
+            else np.full(len(self.types), np.nan)
+        )
+        self.surface_percentiles = (
+            np.asarray(surface_percentiles, dtype=np.float64).reshape(
+                len(self.types), len(PERCENTILES)
+            )
+            if surface_percentiles is not None
+            else np.full((len(self.types), len(PERCENTILES)), np.nan)
+        )
+
+    @classmethod
+    def depuis_lignes(cls, lignes) -> "StatistiquesBiens":
+        """
+        Statistiques lues depuis les lignes d'agrégats SQL :
+        (type_local, nombre, prix moyen, min, max, percentiles, surface
+        moyenne, pièces moyennes, distance max[, percentiles de la surface]),
+        type_local None pour l'ensemble.
+        """
+        lignes = list(lignes)
+        colonnes = list(zip(*lignes)) if lignes else [()] * 9
+
+        def _flottants(valeurs):
+            return [np.nan if v is None else float(v) for v in valeurs]
+
+        def _percentiles(valeurs):
+            return [_flottants(p or [None] * len(PERCENTILES)) for p in valeurs]
+
+        return cls(
+            types=colonnes[0],
+            nombre=colonnes[1],
+            prix_moyen=_flottants(colonnes[2]),
+            prix_min=_flottants(colonnes[3]),
+            prix_max=_flottants(colonnes[4]),
+            prix_percentiles=_percentiles(colonnes[5]),
+            surface_moyenne=_flottants(colonnes[6]),
+            pieces_moyen=_flottants(colonnes[7]),
+            distance_max=_flottants(colonnes[8]),
+            surface_percentiles=(
+                _percentiles(colonnes[9]) if len(colonnes) > 9 else None
+            ),
+        )
+
+    def _par_type(self, valeurs: np.ndarray, decimales: Optional[int] = None) -> dict:
+        """{type_local: valeur} pour les types de bien (hors ensemble)"""
+        return {
+            t: _nombre(v, decimales)
+            for t, v in zip(self.types, valeurs.tolist())
+            if t is not None
+        }
+
+    def _percentiles_par_type(self, percentiles: np.ndarray) -> dict:
+        """{type_local: {"p10": ..., "p90": ...}} pour les types de bien"""
+        return {
+            t: {f"p{p}": _nombre(v, 2) for p, v in zip(PERCENTILES, ligne)}
+            for t, ligne in zip(self.types, percentiles.tolist())
+            if t is not None
+        }
+
+    def par_type(self) -> Dict[str, dict]:
+        """
+        Statistiques par type, avec les clés historiques de `stats_per_type`
+        complétées par la médiane et les percentiles du prix au m² et de la
+        surface
+        """
+        indice_mediane = PERCENTILES.index(50)
+        return {
+            "prix_m2_moyen_par_type": self._par_type(self.prix_moyen, 3),
+            "prix_m2_max_par_type": self._par_type(self.prix_max),
+            "prix_m2_min_par_type": self._par_type(self.prix_min),
+            "prix_m2_median_par_type": self._par_type(
+                self.prix_percentiles[:, indice_mediane], 2
+            ),
+            "prix_m2_percentiles_par_type": self._percentiles_par_type(
+                self.prix_percentiles
+            ),
+            "surface_moyenne_par_type": self._par_type(self.surface_moyenne),
+            "surface_median_par_type": self._par_type(
+                self.surface_percentiles[:, indice_mediane], 2
+            ),
+            "surface_percentiles_par_type": self._percentiles_par_type(
+                self.surface_percentiles
+            ),
+            "nombre_pieces_moyen_par_type": self._par_type(self.pieces_moyen),
+            "nombre_biens_par_type": {
+                t: int(n) for t, n in zip(self.types, self.nombre) if t is not None
+            },
+        }
+
+    def globales(self) -> dict:
+        """Statistiques de l'ensemble des biens ({"nb_biens": 0} s'il est vide)"""
+        if None not in self.types or not self.nombre[self.types.index(None)]:
+            return {"nb_biens": 0}
+        i = self.types.index(None)
+        return {
+            "nb_biens": int(self.nombre[i]),
+            "prix_moyen": _nombre(self.prix_moyen[i], 2),
+            "prix_median": _nombre(self.prix_percentiles[i, PERCENTILES.index(50)], 2),
+            "surface_moyenne": _nombre(self.surface_moyenne[i], 2),
+            "nombre_pieces_moyen": _nombre(self.pieces_moyen[i], 2),
+            "distance_max": _nombre(self.distance_max[i], 1),
+        }
+
+    def series_mensuelles(self) -> Dict[str, List[dict]]:
+        """
+        Séries mensuelles pour des groupes (type_local, mois) :
+        {type_local: [{mois, nombre, prix_m2_moyen, prix_m2_median}, ...]},
+        chaque série étant triée par mois
+        """
+        indice_mediane = PERCENTILES.index(50)
+        series = {}
+        for i, (type_local, mois) in sorted(
+            enumerate(self.types), key=lambda groupe: groupe[1]
+        ):
+            series.setdefault(type_local, []).append(
+                {
+                    "mois": mois,
+                    "nombre": int(self.nombre[i]),
+                    "prix_m2_moyen": _nombre(self.prix_moyen[i], 2),
+                    "prix_m2_median": _nombre(
+                        self.prix_percentiles[i, indice_mediane], 2
+                    ),
+                }
+            )
+        return series
+
+
+def _nombre(valeur: float, decimales: Optional[int] = None) -> Optional[float]:
+    """Valeur JSON d'une statistique : None pour NaN, arrondie si demandé"""
+    if valeur is None or np.isnan(valeur):
+        return None
+    return round(float(valeur), decimales) if decimales is not None else float(valeur)
+
+
+def _colonne(biens, nom: str, dtype=np.float64) -> np.ndarray:
+    """Colonne d'une liste de biens ou d'un dictionnaire de colonnes (None -> NaN)"""
+    if isinstance(biens, dict):
+        valeurs = biens.get(nom)
+        if valeurs is None:
+            return None
+    else:
+        valeurs = [b.get(nom) for b in biens]
+    if dtype is object:
+        return np.asarray(list(valeurs), dtype=object)
+    # Conversion en flottants : None devient NaN
+    return np.asarray(valeurs, dtype=dtype)
+
+
+def calculer_statistiques(
+    biens: Union[List[dict], Dict[str, Sequence]],
+    ensemble: bool = False,
+    groupes: Optional[Sequence] = None,
+) -> StatistiquesBiens:
     """
-    Compte le nombre de biens pour chaque type de bien.
+    Toutes les statistiques par type en une passe vectorisée : un tri
+    groupé (type puis valeur) donne min, max, médiane et percentiles du prix
+    et de la surface, des sommes pondérées par groupe (`np.bincount`)
+    donnent les moyennes.
 
-    :param biens: Liste de dictionnaires contenant les données des biens.
-    :return: Dictionnaire {type_local: nombre de biens} ou message d'erreur.
+    Comme les fonctions historiques, les biens sans type sont ignorés et
+    chaque statistique ne porte que sur les valeurs renseignées.
+
+    :param biens: Liste de biens ou dictionnaire {colonne: valeurs}
+    :param ensemble: Ajouter un groupe (type None) pour l'ensemble des biens
+    :param groupes: Groupe de chaque bien (par exemple (type_local, mois)) à
+        la place du type, None pour un bien ignoré
     """
-    try:
-        stats = {}
-        for b in biens:
-            type_local = b.get("type_local")
-            if type_local:
-                stats[type_local] = stats.get(type_local, 0) + 1
-        return stats
-    except Exception as e:
-        return {"error": f"Erreur dans nombre_biens_par_type: {str(e)}"}
+    if groupes is None:
+        groupes = _colonne(biens, "type_local", object).tolist()
+    prix = _colonne(biens, "prix_m2")
+    surfaces = _colonne(biens, "surface_reelle_bati")
+    pieces = _colonne(biens, "nombre_pieces_principales")
+    distances = _colonne(biens, "distance_m")
+
+    # Codes de groupe dans l'ordre de première apparition des types
+    libelles = list(dict.fromkeys(t for t in groupes if t))
+    codes_types = {t: i for i, t in enumerate(libelles)}
+    codes = np.array([codes_types.get(t, -1) for t in groupes], dtype=np.int64)
+    if ensemble:
+        # L'ensemble est un groupe supplémentaire contenant tous les biens
+        libelles.append(None)
+        codes = np.concatenate([codes, np.full(len(groupes), len(libelles) - 1)])
+        prix, surfaces, pieces = (np.tile(x, 2) for x in (prix, surfaces, pieces))
+        distances = np.tile(distances, 2) if distances is not None else None
+    n_groupes = len(libelles)
+
+    # Les biens sans type ne sont comptés que dans l'ensemble
+    avec_type = codes >= 0
+    codes, prix, surfaces, pieces = (
+        x[avec_type] for x in (codes, prix, surfaces, pieces)
+    )
+    if distances is not None:
+        distances = distances[avec_type]
+
+    def _moyenne(valeurs):
+        renseignes = ~np.isnan(valeurs)
+        nombre = np.bincount(codes[renseignes], minlength=n_groupes)
+        somme = np.bincount(
+            codes[renseignes], weights=valeurs[renseignes], minlength=n_groupes
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(nombre > 0, somme / nombre, np.nan)
+
+    debut = np.concatenate(
+        [[0], np.cumsum(np.bincount(codes, minlength=n_groupes))[:-1]]
+    )
+
+    def _quantiles(valeurs):
+        """(percentiles, minimum, maximum) par groupe des valeurs renseignées"""
+        # Tri par groupe puis par valeur (NaN en fin de groupe)
+        tries = valeurs[np.lexsort((valeurs, codes))]
+        renseignes = np.bincount(codes[~np.isnan(valeurs)], minlength=n_groupes)
+        vides = renseignes == 0
+
+        def _rang(position):
+            indices = np.clip(position, 0, max(len(tries) - 1, 0))
+            rangs = tries[indices] if len(tries) else np.zeros(n_groupes)
+            return np.where(vides, np.nan, rangs)
+
+        # Percentiles par interpolation linéaire (comme numpy et percentile_cont)
+        percentiles = np.empty((n_groupes, len(PERCENTILES)))
+        for j, p in enumerate(PERCENTILES):
+            position = debut + (p / 100) * np.maximum(renseignes - 1, 0)
+            bas = np.floor(position).astype(np.int64)
+            haut = np.ceil(position).astype(np.int64)
+            percentiles[:, j] = _rang(bas) + (_rang(haut) - _rang(bas)) * (
+                position - bas
+            )
+        return percentiles, _rang(debut), _rang(debut + renseignes - 1)
+
+    prix_percentiles, prix_min, prix_max = _quantiles(prix)
+    surface_percentiles, _, _ = _quantiles(surfaces)
+
+    distance_max = None
+    if distances is not None:
+        distance_max = np.full(n_groupes, -np.inf)
+        np.fmax.at(distance_max, codes, distances)
+        distance_max[np.isinf(distance_max)] = np.nan
+
+    return StatistiquesBiens(
+        types=libelles,
+        nombre=np.bincount(codes, minlength=n_groupes),
+        prix_moyen=_moyenne(prix),
+        prix_min=prix_min,
+        prix_max=prix_max,
+        prix_percentiles=prix_percentiles,
+        surface_moyenne=_moyenne(surfaces),
+        pieces_moyen=_moyenne(pieces),
+        distance_max=distance_max,
+        surface_percentiles=surface_percentiles,
+    )
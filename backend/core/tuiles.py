@@ -0,0 +1,26 @@
+from math import floor
+from typing import List, Tuple
+
+
+# Découpage en tuiles régulières de TUILE_DEG degrés (≈ 220 m x 150 m en IDF).
+# Clé d'une tuile : ligne (latitude) puis colonne (longitude), soit
+# floor(lat / TUILE_DEG) * FACTEUR_LIGNE + floor(lon / TUILE_DEG) ; les tuiles
+# d'une même ligne ont des clés consécutives. Doit rester identique au calcul
+# de la colonne `tuile` dans dataset_builder/dvf_ingestion_to_neon.py
+TUILE_DEG = 0.002
+FACTEUR_LIGNE = 100000
+
+
+def plages_tuiles(
+    lat_min: float, lat_max: float, lon_min: float, lon_max: float
+) -> List[Tuple[int, int]]:
+    """
+    Plages de clés des tuiles couvrant la boîte, une plage par ligne de tuiles.
+
+    :return: Liste de couples (clé de début, clé de fin), bornes incluses
+    """
+    col_min, col_max = floor(lon_min / TUILE_DEG), floor(lon_max / TUILE_DEG)
+    return [
+        (ligne * FACTEUR_LIGNE + col_min, ligne * FACTEUR_LIGNE + col_max)
+        for ligne in range(floor(lat_min / TUILE_DEG), floor(lat_max / TUILE_DEG) + 1)
+    ]
@@ -0,0 +1,45 @@
+import numpy as np
+
+from core.geocod import (
+    RAYON_TERRE_M,
+    _colonnes_vers_biens,
+    haversine_distance_batch,
+)
+
+LAT, LON = 48.85, 2.35
+
+
+def _vente(distance_m: float, adresse: str) -> dict:
+    """Vente située à `distance_m` mètres au nord du point de recherche"""
+    return {
+        "latitude": LAT + np.degrees(distance_m / RAYON_TERRE_M),
+        "longitude": LON,
+        "prix_m2": 10000.0,
+        "type_local": "Appartement",
+        "date_mutation": "2024-01-01",
+        "annee": 2024,
+        "surface_reelle_bati": 50.0,
+        "id_mutation": adresse,
+        "nombre_pieces_principales": 2,
+        "adresse": adresse,
+    }
+
+
+def test_tri_et_coupure_dans_un_meme_dixieme_de_metre():
+    # Deux ventes du même dixième de mètre, la plus lointaine en premier
+    ventes = [_vente(100.04, "loin"), _vente(100.01, "pres")]
+    colonnes = {nom: [v[nom] for v in ventes] for nom in ventes[0]}
+
+    biens = _colonnes_vers_biens(colonnes, LAT, LON, 1000)
+
+    assert [b["adresse"] for b in biens] == ["pres", "loin"]
+    assert [b["distance_m"] for b in biens] == [100.0, 100.0]
+
+    # Coupure du cache des biens (rechercher_biens) entre les deux ventes
+    distances = haversine_distance_batch(
+        LAT, LON, [b["latitude"] for b in biens], [b["longitude"] for b in biens]
+    )
+    assert np.all(np.diff(distances) >= 0)
+    rayon = (distances[0] + distances[1]) / 2
+    coupure = int(np.searchsorted(distances, rayon, side="right"))
+    assert [b["adresse"] for b in biens[:coupure]] == ["pres"]
@@ -1,8 +1,24 @@
-import pandas as pd
+import email.utils
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 import duckdb
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from dotenv import load_dotenv
-import os
+
+try:
+    import resource
+except ImportError:  # hors Unix : pic de RSS non mesuré
+    resource = None
 
 load_dotenv()
 
@@ -11,97 +27,872 @@ neon_url = os.getenv("NEON_DB_URL")
 
 # Paramètres de base
 departements_idf = ["75", "92", "93", "94", "95", "78", "91", "77"]
-annee = 2024
-base_url = f"https://files.data.gouv.fr/geo-dvf/latest/csv/{annee}/departements"
+# Années ingérées (géo-DVF publie les cinq dernières années), par exemple
+# DVF_ANNEES=2023,2024
+annees = [
+    int(a) for a in os.getenv("DVF_ANNEES", "2020,2021,2022,2023,2024").split(",")
+]
+base_url = "https://files.data.gouv.fr/geo-dvf/latest/csv/{annee}/departements"
+# Table des ventes partitionnée par année (une partition
+# valeurs_foncieres_idf_<annee> par année)
+table = "valeurs_foncieres_idf"
+# Table de staging : ventes des fichiers modifiés depuis la dernière ingestion
+table_chargement = f"{table}_chargement"
+table_adresses = "adresses_idf"
+table_cube = "agregats_idf"
+table_metadonnees = "metadonnees_dvf"
+# Empreinte du contenu de chaque fichier DVF chargé
+table_fichiers = "fichiers_dvf"
 
-# Chargement des données pour chaque département
-df_list = []
+# Tuiles spatiales : doit rester identique à backend/core/tuiles.py
+TUILE_DEG = 0.002
+FACTEUR_LIGNE = 100000
 
-for dep in departements_idf:
-    url = f"{base_url}/{dep}.csv.gz"
-    print(f"Chargement : {url}")
+# Sketchs de quantiles : doit rester identique à backend/core/sketch.py
+PRECISION_SKETCH = 0.01
 
+# Mémoire allouée à DuckDB, qui écrit sur disque au-delà (par exemple 1GB)
+memoire_duckdb = os.getenv("DUCKDB_MEMOIRE", "2GB")
+# Nombre de lignes envoyées à la base par lot (une commande COPY par lot)
+taille_lot = int(os.getenv("TAILLE_LOT", "100000"))
+# Miroir local des fichiers DVF (<miroir>/<annee>/<departement>.csv.gz) : les
+# fichiers téléchargés y sont enregistrés (répertoire temporaire si non
+# défini), un fichier présent n'est téléchargé à nouveau que si le fichier
+# publié est plus récent (requête conditionnelle If-Modified-Since)
+miroir = os.getenv("DVF_MIROIR")
+# Fichiers du miroir utilisés sans interroger data.gouv.fr (ingestion hors ligne)
+hors_ligne = os.getenv("DVF_HORS_LIGNE", "0") == "1"
+# Départements téléchargés et lus simultanément, essais par téléchargement
+parallelisme = int(os.getenv("DVF_PARALLELISME", "4"))
+essais = int(os.getenv("DVF_ESSAIS", "3"))
+# Relecture de tous les fichiers, même ceux inchangés depuis la dernière
+# ingestion (après une évolution des transformations par exemple)
+rechargement_complet = os.getenv("DVF_COMPLET", "0") == "1"
+# Fichier Parquet des ventes triées par tuile (moteur DuckDB du backend),
+# réécrit à chaque ingestion qui modifie la base, ou s'il est absent ou d'une
+# autre version que la base. Sans NEON_DB_URL, tous les fichiers DVF sont lus
+# et seul ce fichier est écrit (ingestion hors ligne).
+fichier_parquet = os.getenv("DVF_PARQUET")
+# Lignes par groupe du fichier Parquet : les statistiques min/max de chaque
+# groupe (tuile, latitude...) permettent de ne lire que les groupes utiles
+LIGNES_PAR_GROUPE_PARQUET = 16384
+
+# Colonnes DVF utiles et leur type, dans l'ordre de la table des ventes :
+# les autres colonnes des fichiers ne sont pas lues
+colonnes_dvf = {
+    "surface_reelle_bati": "DOUBLE",
+    "nombre_pieces_principales": "DOUBLE",
+    "type_local": "VARCHAR",
+    "code_postal": "DOUBLE",
+    "nom_commune": "VARCHAR",
+    "longitude": "DOUBLE",
+    "latitude": "DOUBLE",
+    "nature_mutation": "VARCHAR",
+    "date_mutation": "VARCHAR",
+    "valeur_fonciere": "DOUBLE",
+    "id_mutation": "VARCHAR",
+    "adresse_numero": "DOUBLE",
+    "adresse_nom_voie": "VARCHAR",
+}
+# Colonnes (éventuellement vides) ordonnant les lots d'une mutation : elles
+# servent à numéroter les lots et ne sont pas conservées
+colonnes_lot = {"id_parcelle": "VARCHAR", "lot1_numero": "VARCHAR"}
+# Types Postgres des colonnes DuckDB de la table des ventes
+types_postgres = {
+    "DOUBLE": "DOUBLE PRECISION",
+    "VARCHAR": "TEXT",
+    "INTEGER": "INTEGER",
+    "BIGINT": "BIGINT",
+}
+types_duckdb = {t.lower(): t_duckdb for t_duckdb, t in types_postgres.items()}
+# Identité d'une vente : mutation (dans le fichier de son département) et
+# numéro du lot dans la mutation ; la clé de partition annee fait partie de
+# toute contrainte d'unicité
+cle_vente = ["annee", "departement", "id_mutation", "lot"]
+
+
+def rss_mo():
+    """RSS courante du processus en Mo (Linux), None si indisponible"""
     try:
-        df = pd.read_csv(url, sep=",", compression="gzip", low_memory=False)
-        df["departement"] = dep
-        df_list.append(df)
-    except Exception as e:
-        print(f"Erreur lors du chargement du département {dep} : {e}")
-
-# Fusion des DataFrames
-df_idf = pd.concat(df_list, ignore_index=True)
-
-# Sélection des colonnes utiles
-features = [
-    "surface_reelle_bati",
-    "nombre_pieces_principales",
-    "type_local",
-    "code_postal",
-    "longitude",
-    "latitude",
-    "nature_mutation",
-    "date_mutation",
-    "valeur_fonciere",
-    "id_mutation",
-    "adresse_numero",
-    "adresse_nom_voie",
-]
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
 
-df_idf = df_idf[features]
 
-# Filtrage : uniquement ventes de maisons et appartements
-query_1 = """
-    SELECT *
-    FROM df_idf
-    WHERE type_local IN ('Appartement', 'Maison') 
-    AND nature_mutation = 'Vente'
-"""
-df_idf = duckdb.query(query_1).df()
-
-# Suppression des lignes avec valeurs manquantes
-df_idf.dropna(inplace=True)
-# création de la colonne adresse
-df_idf["adresse"] = (
-    df_idf["adresse_numero"]
-    .astype(int)
-    .astype(str)
-    .str.cat(df_idf["adresse_nom_voie"].str.lower(), sep=" ")
+@contextmanager
+def etape(nom):
+    """Affiche la durée d'une étape, la RSS et le pic de RSS du processus à sa fin"""
+    debut = time.perf_counter()
+    yield
+    mesures = [f"{time.perf_counter() - debut:.1f}s"]
+    rss = rss_mo()
+    if rss is not None:
+        mesures.append(f"RSS {rss:.0f} Mo")
+    if resource is not None:
+        # ru_maxrss est en Ko sous Linux
+        pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        mesures.append(f"pic RSS {pic:.0f} Mo")
+    print(f"[{nom}] " + ", ".join(mesures))
+
+
+if not neon_url and not fichier_parquet:
+    raise SystemExit("NEON_DB_URL ou DVF_PARQUET doit être défini")
+engine = create_engine(neon_url) if neon_url else None
+
+# État de la base : la table des ventes est (re)créée à la première
+# ingestion ou si elle date d'un format sans identité de lot, sinon seuls
+# les fichiers dont l'empreinte a changé sont relus
+tables_existantes = set()
+creation = True
+if engine is not None:
+    inspecteur = inspect(engine)
+    tables_existantes = set(inspecteur.get_table_names())
+    creation = table not in tables_existantes or "lot" not in {
+        c["name"] for c in inspecteur.get_columns(table)
+    }
+empreintes_connues = {}
+if not creation and not rechargement_complet and table_fichiers in tables_existantes:
+    with engine.connect() as conn:
+        empreintes_connues = {
+            (annee, dep): empreinte
+            for annee, dep, empreinte in conn.execute(
+                text(f"SELECT annee, departement, empreinte FROM {table_fichiers}")
+            )
+        }
+
+# Base DuckDB temporaire sur disque : les tables des départements, la table
+# des ventes et les opérateurs (fenêtres, tri) débordent sur disque au-delà
+# de la mémoire allouée
+repertoire_duckdb = tempfile.TemporaryDirectory()
+con = duckdb.connect(os.path.join(repertoire_duckdb.name, "dvf.duckdb"))
+con.execute(f"SET memory_limit = '{memoire_duckdb}'")
+con.execute("SET preserve_insertion_order = false")
+repertoire_fichiers = miroir or repertoire_duckdb.name
+
+types_dvf = ", ".join(
+    f"'{c}': '{t}'" for c, t in {**colonnes_dvf, **colonnes_lot}.items()
 )
-# suppression des colonne 'adresse_numero', 'adresse_nom_voie'
-df_idf.drop(["adresse_numero", "adresse_nom_voie"], axis=1, inplace=True)
-
-# Calcul du prix au mètre carré
-query_2 = """
-    WITH prix_par_m2 AS (
-        SELECT 
-            id_mutation, 
-            MAX(valeur_fonciere) / SUM(surface_reelle_bati) AS prix_m2
-        FROM df_idf
-        GROUP BY id_mutation
+colonnes_renseignees = " AND ".join(f"{c} IS NOT NULL" for c in colonnes_dvf)
+# Affichages des tâches parallèles, une ligne à la fois
+verrou_affichage = threading.Lock()
+
+
+def afficher(message):
+    with verrou_affichage:
+        print(message)
+
+
+def fichier_departement(annee, dep):
+    """
+    Chemin local du fichier DVF d'un département, téléchargé s'il est absent
+    du miroir ou si le fichier publié est plus récent que sa copie (la date de
+    modification de la copie est celle du fichier publié). Avec
+    DVF_HORS_LIGNE, une copie présente est utilisée sans vérification. Un
+    téléchargement échoué est relancé jusqu'à `essais` fois, avec une
+    attente doublée à chaque essai.
+    """
+    chemin = os.path.join(repertoire_fichiers, str(annee), f"{dep}.csv.gz")
+    present = os.path.exists(chemin)
+    if present and hors_ligne:
+        return chemin
+    os.makedirs(os.path.dirname(chemin), exist_ok=True)
+    url = f"{base_url.format(annee=annee)}/{dep}.csv.gz"
+    requete = urllib.request.Request(url)
+    if present:
+        requete.add_header(
+            "If-Modified-Since",
+            email.utils.formatdate(os.path.getmtime(chemin), usegmt=True),
+        )
+    for essai in range(1, essais + 1):
+        try:
+            # Fichier partiel renommé une fois complet : un miroir ne contient
+            # jamais de fichier tronqué
+            with urllib.request.urlopen(requete, timeout=60) as reponse, open(
+                f"{chemin}.partiel", "wb"
+            ) as f:
+                shutil.copyfileobj(reponse, f)
+                publication = reponse.headers.get("Last-Modified")
+            if publication:
+                date = email.utils.parsedate_to_datetime(publication).timestamp()
+                os.utime(f"{chemin}.partiel", (date, date))
+            os.replace(f"{chemin}.partiel", chemin)
+            return chemin
+        except urllib.error.HTTPError as e:
+            # Copie du miroir à jour
+            if present and e.code == 304:
+                return chemin
+            erreur = e
+        except OSError as e:
+            erreur = e
+        if essai == essais:
+            raise RuntimeError(
+                f"Téléchargement de {url} impossible : {erreur}"
+            ) from erreur
+        attente = 2**essai
+        afficher(
+            f"Téléchargement de {url} échoué ({erreur}), nouvel essai dans {attente}s"
+        )
+        time.sleep(attente)
+
+
+def empreinte_fichier(chemin):
+    """Empreinte SHA-256 du contenu d'un fichier, lu par blocs de 1 Mo"""
+    empreinte = hashlib.sha256()
+    with open(chemin, "rb") as f:
+        for bloc in iter(lambda: f.read(2**20), b""):
+            empreinte.update(bloc)
+    return empreinte.hexdigest()
+
+
+def lire_departement(annee, dep):
+    """
+    Télécharge (si besoin) le fichier d'un département et, si son empreinte
+    a changé depuis la dernière ingestion, le lit dans sa propre table
+    DuckDB : seules les colonnes utiles sont lues, filtrées pendant la
+    lecture. Chaque tâche a son curseur (les curseurs d'une même connexion
+    DuckDB s'exécutent en parallèle).
+
+    :return: (annee, departement, empreinte, nom de la table ou None si le
+        fichier est inchangé)
+    """
+    debut = time.perf_counter()
+    chemin = fichier_departement(annee, dep)
+    empreinte = empreinte_fichier(chemin)
+    duree_fichier = time.perf_counter() - debut
+    if empreintes_connues.get((annee, dep)) == empreinte:
+        afficher(f"[{dep} {annee}] fichier {duree_fichier:.1f}s, inchangé")
+        return annee, dep, empreinte, None
+
+    nom = f"dvf_{annee}_{dep}"
+    curseur = con.cursor()
+    try:
+        curseur.execute(
+            f"""
+            CREATE TABLE {nom} AS
+            SELECT {", ".join(colonnes_dvf)}, {", ".join(colonnes_lot)},
+                '{dep}' AS departement
+            FROM read_csv({chemin!r}, header = true, types = {{{types_dvf}}})
+            WHERE type_local IN ('Appartement', 'Maison')
+                AND nature_mutation = 'Vente'
+                AND {colonnes_renseignees}
+            """
+        )
+        nombre = curseur.execute(f"SELECT COUNT(*) FROM {nom}").fetchone()[0]
+    finally:
+        curseur.close()
+    afficher(
+        f"[{dep} {annee}] fichier {duree_fichier:.1f}s, "
+        f"lecture {time.perf_counter() - debut - duree_fichier:.1f}s, "
+        f"{os.path.getsize(chemin) / 2**20:.1f} Mo, {nombre} lignes retenues"
     )
-    SELECT df_idf.*, prix_par_m2.prix_m2
-    FROM df_idf
-    LEFT JOIN prix_par_m2 USING(id_mutation)
-"""
-df_idf = duckdb.query(query_2).df()
+    return annee, dep, empreinte, nom
+
 
-# Filtrage : valeurs cohérentes du prix au m²
-query_3 = """
-    SELECT *
-    FROM df_idf
-    WHERE prix_m2 BETWEEN 1000 AND 25000
+def version_fichiers(empreintes):
+    """
+    Version des données : empreinte des fichiers DVF chargés, séquence de
+    (annee, departement, empreinte). Le backend en dérive ses ETags, une
+    ingestion des mêmes données conserve donc les caches HTTP des clients.
+    """
+    contenu = ",".join(f"{a}/{d}:{e}" for a, d, e in sorted(empreintes))
+    return hashlib.sha256(contenu.encode()).hexdigest()[:16]
+
+
+def ecrire_parquet(source, version):
+    """
+    Écrit les ventes de `source` (table ou fonction de table DuckDB) dans le
+    fichier Parquet, triées par tuile : une recherche par rayon ne lit que
+    les groupes de lignes de ses tuiles. La version des données est écrite
+    dans les métadonnées du fichier, remplacé en une fois (renommage).
+    """
+    partiel = f"{fichier_parquet}.partiel"
+    with etape("parquet"):
+        con.execute(
+            f"""
+            COPY (SELECT * FROM {source} ORDER BY tuile, annee)
+            TO '{partiel}' (
+                FORMAT parquet,
+                COMPRESSION zstd,
+                ROW_GROUP_SIZE {LIGNES_PAR_GROUPE_PARQUET},
+                KV_METADATA {{version: '{version}'}}
+            )
+            """
+        )
+        os.replace(partiel, fichier_parquet)
+    print(f"Fichier Parquet {fichier_parquet} écrit (version {version})")
+
+
+def version_parquet():
+    """Version des données du fichier Parquet existant (None s'il est absent ou illisible)"""
+    if not os.path.exists(fichier_parquet):
+        return None
+    try:
+        ligne = con.execute(
+            "SELECT value FROM parquet_kv_metadata(?) "
+            "WHERE CAST(key AS VARCHAR) = 'version'",
+            [fichier_parquet],
+        ).fetchone()
+    except duckdb.Error:
+        return None
+    return bytes(ligne[0]).decode() if ligne else None
+
+
+def exporter_parquet(version):
+    """Exporte toute la table des ventes de la base (COPY TO STDOUT) en Parquet"""
+    fichier_csv = os.path.join(repertoire_duckdb.name, "export.csv")
+    connexion = engine.raw_connection()
+    try:
+        with connexion.cursor() as curseur, open(fichier_csv, "w") as f:
+            curseur.execute(
+                "SELECT column_name, data_type FROM information_schema.columns "
+                "WHERE table_name = %s ORDER BY ordinal_position",
+                (table,),
+            )
+            types_export = {c: types_duckdb[t] for c, t in curseur.fetchall()}
+            curseur.copy_expert(
+                f"COPY (SELECT {', '.join(types_export)} FROM {table}) "
+                "TO STDOUT WITH (FORMAT csv)",
+                f,
+            )
+    finally:
+        connexion.close()
+    colonnes_export = ", ".join(f"'{c}': '{t}'" for c, t in types_export.items())
+    ecrire_parquet(
+        f"read_csv('{fichier_csv}', header = false, columns = {{{colonnes_export}}})",
+        version,
+    )
+    os.remove(fichier_csv)
+
+
+# Pool borné de tâches par département et par année : téléchargement et
+# lecture se recouvrent d'un département à l'autre. Un département en échec
+# (après ses essais) interrompt l'ingestion.
+with etape("téléchargement et lecture des départements"):
+    with ThreadPoolExecutor(max_workers=parallelisme) as pool:
+        fichiers_modifies = [
+            resultat
+            for resultat in pool.map(
+                lambda tache: lire_departement(*tache),
+                [(annee, dep) for annee in annees for dep in departements_idf],
+            )
+            if resultat[3] is not None
+        ]
+
+if not fichiers_modifies:
+    print("Aucun fichier DVF modifié depuis la dernière ingestion : base inchangée")
+    if fichier_parquet:
+        # Fichier Parquet absent ou en retard sur la base : réexporté
+        with engine.connect() as conn:
+            version = version_fichiers(
+                conn.execute(
+                    text(f"SELECT annee, departement, empreinte FROM {table_fichiers}")
+                ).fetchall()
+            )
+        if version_parquet() != version:
+            exporter_parquet(version)
+        else:
+            print(f"Fichier Parquet {fichier_parquet} à jour (version {version})")
+    con.close()
+    repertoire_duckdb.cleanup()
+    raise SystemExit(0)
+tables_departements = [nom for _, _, _, nom in fichiers_modifies]
+
+# Un seul plan DuckDB des tables des départements modifiés à la table des
+# ventes : le prix au m² de chaque mutation est calculé par fonctions de
+# fenêtre (sans auto-jointure), comme le numéro de chaque lot dans sa
+# mutation. Une mutation est propre au fichier de son département, relu en
+# entier s'il a changé. La clé de tuile spatiale (ligne de latitude puis colonne de
+# longitude) sert au tri des ventes
+with etape("transformation"):
+    con.execute(
+        f"""
+        CREATE TABLE ventes AS
+        WITH dvf AS (
+            SELECT *, CAST(LEFT(date_mutation, 4) AS INTEGER) AS annee
+            FROM ({" UNION ALL ".join(f"FROM {t}" for t in tables_departements)})
+        ),
+        avec_prix AS (
+            SELECT
+                *,
+                MAX(valeur_fonciere) OVER mutation
+                    / SUM(surface_reelle_bati) OVER mutation AS prix_m2,
+                ROW_NUMBER() OVER (
+                    PARTITION BY departement, id_mutation
+                    ORDER BY {", ".join(colonnes_lot)}, type_local,
+                        surface_reelle_bati, nombre_pieces_principales,
+                        adresse_numero, adresse_nom_voie, longitude, latitude
+                ) AS lot
+            FROM dvf
+            WINDOW mutation AS (PARTITION BY departement, id_mutation)
+        )
+        SELECT
+            surface_reelle_bati,
+            nombre_pieces_principales,
+            type_local,
+            code_postal,
+            nom_commune,
+            longitude,
+            latitude,
+            date_mutation,
+            id_mutation,
+            annee,
+            departement,
+            lot,
+            CAST(CAST(adresse_numero AS BIGINT) AS VARCHAR)
+                || ' ' || LOWER(adresse_nom_voie) AS adresse,
+            prix_m2,
+            CAST(FLOOR(latitude / {TUILE_DEG}) AS BIGINT) * {FACTEUR_LIGNE}
+                + CAST(FLOOR(longitude / {TUILE_DEG}) AS BIGINT) AS tuile
+        FROM avec_prix
+        WHERE prix_m2 BETWEEN 1000 AND 25000
+            AND annee IN ({", ".join(map(str, annees))})
+        ORDER BY annee, tuile
+        """
+    )
+    for t in tables_departements:
+        con.execute(f"DROP TABLE {t}")
+    nombre_ventes = con.execute("SELECT COUNT(*) FROM ventes").fetchone()[0]
+    types_ventes = {
+        colonne: type_colonne
+        for colonne, type_colonne, *_ in con.execute("DESCRIBE ventes").fetchall()
+    }
+    colonnes_ventes = list(types_ventes)
+
+print(
+    f"Dataset prêt : {nombre_ventes} ventes dans {len(fichiers_modifies)} "
+    f"fichiers modifiés"
+)
+
+if engine is None:
+    # Ingestion hors ligne : tous les fichiers ont été lus
+    ecrire_parquet(
+        "ventes",
+        version_fichiers(
+            (annee, dep, empreinte) for annee, dep, empreinte, _ in fichiers_modifies
+        ),
+    )
+    con.close()
+    repertoire_duckdb.cleanup()
+    raise SystemExit(0)
+
+# Envoi des ventes des fichiers modifiés dans Neon par le protocole COPY,
+# dans une table de staging non journalisée et sans index : chaque lot de
+# lignes (plage de rowid) est écrit en CSV par DuckDB puis envoyé par une
+# commande COPY, aucun lot n'est converti en Python
+colonnes = ", ".join(colonnes_ventes)
+definition_chargement = ", ".join(
+    f"{c} {types_postgres[t]}" for c, t in types_ventes.items()
+)
+with etape("chargement"):
+    debut = time.perf_counter()
+    connexion = engine.raw_connection()
+    try:
+        with connexion.cursor() as curseur:
+            curseur.execute(f"DROP TABLE IF EXISTS {table_chargement}")
+            curseur.execute(
+                f"CREATE UNLOGGED TABLE {table_chargement} ({definition_chargement})"
+            )
+            fichier_lot = os.path.join(repertoire_duckdb.name, "lot.csv")
+            for debut_lot in range(0, nombre_ventes, taille_lot):
+                con.execute(
+                    f"""
+                    COPY (
+                        SELECT {colonnes} FROM ventes
+                        WHERE rowid >= {debut_lot} AND rowid < {debut_lot + taille_lot}
+                    ) TO '{fichier_lot}' (HEADER false)
+                    """
+                )
+                with open(fichier_lot) as f:
+                    curseur.copy_expert(
+                        f"COPY {table_chargement} ({colonnes}) FROM STDIN WITH (FORMAT csv)",
+                        f,
+                    )
+        connexion.commit()
+    finally:
+        connexion.close()
+    duree_chargement = time.perf_counter() - debut
+print(
+    f"{nombre_ventes} ventes chargées en {duree_chargement:.1f}s "
+    f"({nombre_ventes / max(duree_chargement, 1e-9):.0f} lignes/s)"
+)
+
+
+def creer_partitions(conn, annees_partitions, table_ventes=table):
+    """Partitions d'années de la table des ventes `table_ventes`"""
+    for annee in annees_partitions:
+        partition = f"{table_ventes}_{annee}"
+        # Une table d'une ingestion mono-année peut porter le nom de la partition
+        conn.execute(text(f"DROP TABLE IF EXISTS {partition}"))
+        conn.execute(
+            text(
+                f"CREATE TABLE {partition} PARTITION OF {table_ventes} "
+                f"FOR VALUES IN ({annee})"
+            )
+        )
+
+
+def indexer_partitions(conn, annees_partitions, table_ventes=table):
+    """
+    Index B-tree sur la clé de tuile des partitions (l'index d'unicité de la
+    table parente s'y propage de lui-même)
+    """
+    for annee in annees_partitions:
+        partition = f"{table_ventes}_{annee}"
+        conn.execute(
+            text(f"CREATE INDEX idx_{partition}_tuile ON {partition} (tuile)")
+        )
+
+
+def requete_adresses(condition="", source=table):
+    """
+    Adresses (coordonnées moyennes des ventes) des ventes de `source`
+    vérifiant `condition`
+    """
+    return f"""
+        SELECT
+            adresse,
+            CAST(code_postal AS INTEGER) AS code_postal,
+            nom_commune,
+            AVG(latitude) AS latitude,
+            AVG(longitude) AS longitude,
+            COUNT(*) AS nb_ventes
+        FROM {source}
+        {condition}
+        GROUP BY adresse, CAST(code_postal AS INTEGER), nom_commune
+    """
+
+
+# Cube d'agrégats par tuile, type de bien, année et mois : nombres, sommes, min/max
+# et sketchs de quantiles (compteurs par seau ceil(ln(x) / ln(gamma)), en
+# JSON) du prix au m² et de la surface. Le backend additionne les tuiles
+# entièrement comprises dans le cercle de recherche.
+ln_gamma = math.log((1 + PRECISION_SKETCH) / (1 - PRECISION_SKETCH))
+
+
+def requete_sketch(colonne):
+    """Sketch JSON {seau: nombre} de `colonne` par tuile, type, année et mois"""
+    return f"""
+        SELECT tuile, type_local, annee, mois,
+            jsonb_object_agg(seau, nombre) AS sketch_{colonne}
+        FROM (
+            SELECT tuile, type_local, annee, mois,
+                CAST(CEIL(LN({colonne}) / {ln_gamma!r}) AS INTEGER) AS seau,
+                COUNT(*) AS nombre
+            FROM ventes
+            WHERE {colonne} > 0
+            GROUP BY tuile, type_local, annee, mois, seau
+        ) AS seaux
+        GROUP BY tuile, type_local, annee, mois
+    """
+
+
+def requete_cube(condition="", source=table):
+    """Lignes du cube des ventes de `source` vérifiant `condition`"""
+    return f"""
+        WITH ventes AS (
+            SELECT
+                tuile,
+                type_local,
+                annee,
+                LEFT(CAST(date_mutation AS TEXT), 7) AS mois,
+                prix_m2,
+                surface_reelle_bati,
+                nombre_pieces_principales
+            FROM {source}
+            {condition}
+        ),
+        agregats AS (
+            SELECT
+                tuile,
+                type_local,
+                annee,
+                mois,
+                COUNT(*) AS nombre,
+                SUM(prix_m2) AS somme_prix,
+                COUNT(prix_m2) AS nombre_prix,
+                MIN(prix_m2) AS prix_min,
+                MAX(prix_m2) AS prix_max,
+                SUM(surface_reelle_bati) AS somme_surface,
+                COUNT(surface_reelle_bati) AS nombre_surface,
+                SUM(nombre_pieces_principales) AS somme_pieces,
+                COUNT(nombre_pieces_principales) AS nombre_pieces
+            FROM ventes
+            GROUP BY tuile, type_local, annee, mois
+        )
+        SELECT *
+        FROM agregats
+        LEFT JOIN ({requete_sketch("prix_m2")}) AS sp
+            USING (tuile, type_local, annee, mois)
+        LEFT JOIN ({requete_sketch("surface_reelle_bati")}) AS ss
+            USING (tuile, type_local, annee, mois)
+        ORDER BY tuile
+    """
+
+
+# Une nouvelle année est ajoutée à la table existante par une transaction
+# courte (verrou exclusif sur la table parente le temps de la création)
+nouvelles_annees = [a for a in annees if f"{table}_{a}" not in tables_existantes]
+if not creation and nouvelles_annees:
+    with engine.begin() as conn:
+        creer_partitions(conn, nouvelles_annees)
+        indexer_partitions(conn, nouvelles_annees)
+
+# Mise à jour en une seule transaction : suppression des ventes disparues des
+# fichiers modifiés, upsert des ventes de la table de staging sur leur
+# identité (année, département, mutation, lot), puis recalcul des adresses
+# et des tuiles du cube touchées. Les lectures du backend ne sont pas
+# bloquées et voient l'ancien état jusqu'au commit, puis le nouveau en entier.
+# À la création, ventes, adresses et cube sont construits dans des tables
+# <nom>_nouveau (la table des ventes est remplie avant la construction de ses
+# index), échangées en fin de transaction avec les tables lues par le
+# backend : celles-ci ne sont verrouillées que de l'échange au commit.
+suffixe = "_nouveau" if creation else ""
+table_ventes = f"{table}{suffixe}"
+fichiers = {
+    "annees": [annee for annee, _, _, _ in fichiers_modifies],
+    "departements": [dep for _, dep, _, _ in fichiers_modifies],
+}
+selection_fichiers = """
+    (annee, departement) IN (
+        SELECT * FROM unnest(CAST(:annees AS INTEGER[]), CAST(:departements AS TEXT[]))
+    )
 """
-df_idf = duckdb.query(query_3).df()
+colonnes_valeurs = [c for c in colonnes_ventes if c not in cle_vente]
+with engine.begin() as conn:
+    with etape("mise à jour des ventes"):
+        if creation:
+            # Table partitionnée par année (LIST) : une recherche limitée à
+            # certaines années ne lit que leurs partitions
+            conn.execute(text(f"DROP TABLE IF EXISTS {table_ventes} CASCADE"))
+            conn.execute(
+                text(
+                    f"CREATE TABLE {table_ventes} (LIKE {table_chargement}) "
+                    "PARTITION BY LIST (annee)"
+                )
+            )
+            creer_partitions(conn, annees, table_ventes)
+            ecrites = conn.execute(
+                text(
+                    f"INSERT INTO {table_ventes} ({colonnes}) "
+                    f"SELECT {colonnes} FROM {table_chargement}"
+                )
+            ).rowcount
+            supprimees = 0
+            conn.execute(
+                text(
+                    f"CREATE UNIQUE INDEX idx_{table_ventes}_vente "
+                    f"ON {table_ventes} ({', '.join(cle_vente)})"
+                )
+            )
+            indexer_partitions(conn, annees, table_ventes)
+            # Regroupement physique des lignes par tuile dans chaque partition :
+            # une recherche par rayon ne lit que quelques pages contiguës
+            for annee in annees:
+                partition = f"{table_ventes}_{annee}"
+                conn.execute(text(f"CLUSTER {partition} USING idx_{partition}_tuile"))
+        else:
+            # Tuiles et adresses touchées : celles des ventes des fichiers
+            # modifiés, avant et après la mise à jour
+            conn.execute(
+                text(
+                    f"""
+                    CREATE TEMPORARY TABLE touchees ON COMMIT DROP AS
+                    SELECT tuile, adresse, CAST(code_postal AS INTEGER) AS code_postal,
+                        nom_commune
+                    FROM {table}
+                    WHERE {selection_fichiers}
+                    UNION
+                    SELECT tuile, adresse, CAST(code_postal AS INTEGER), nom_commune
+                    FROM {table_chargement}
+                    """
+                ),
+                fichiers,
+            )
+            conn.execute(text("ANALYZE touchees"))
+            supprimees = conn.execute(
+                text(
+                    f"""
+                    DELETE FROM {table} AS v
+                    WHERE {selection_fichiers}
+                        AND NOT EXISTS (
+                            SELECT 1 FROM {table_chargement} AS c
+                            WHERE ({", ".join(f"c.{c}" for c in cle_vente)})
+                                = ({", ".join(f"v.{c}" for c in cle_vente)})
+                        )
+                    """
+                ),
+                fichiers,
+            ).rowcount
+            # Les ventes identiques ne sont pas réécrites
+            ecrites = conn.execute(
+                text(
+                    f"""
+                    INSERT INTO {table} ({colonnes})
+                    SELECT {colonnes} FROM {table_chargement}
+                    ON CONFLICT ({", ".join(cle_vente)}) DO UPDATE
+                    SET {", ".join(f"{c} = EXCLUDED.{c}" for c in colonnes_valeurs)}
+                    WHERE ({", ".join(f"{table}.{c}" for c in colonnes_valeurs)})
+                        IS DISTINCT FROM
+                        ({", ".join(f"EXCLUDED.{c}" for c in colonnes_valeurs)})
+                    """
+                )
+            ).rowcount
+        conn.execute(text(f"DROP TABLE {table_chargement}"))
+        conn.execute(text(f"ANALYZE {table_ventes}"))
+    print(
+        f"Table {table} : {ecrites} ventes insérées ou modifiées, "
+        f"{supprimees} supprimées"
+    )
 
-# Suppression des colonnes devenues inutiles
-df_idf.drop(["valeur_fonciere", "nature_mutation"], axis=1, inplace=True)
+    # Répertoire local des adresses (géocodeur hors ligne du backend) :
+    # une ligne par adresse, coordonnées moyennes des ventes
+    with etape("adresses"):
+        if creation or table_adresses not in tables_existantes:
+            cible = f"{table_adresses}{suffixe}"
+            conn.execute(text(f"DROP TABLE IF EXISTS {cible}"))
+            conn.execute(
+                text(
+                    f"CREATE TABLE {cible} AS "
+                    f"{requete_adresses(source=table_ventes)}"
+                )
+            )
+        else:
+            conn.execute(
+                text(
+                    f"""
+                    DELETE FROM {table_adresses}
+                    WHERE (adresse, code_postal, nom_commune) IN (
+                        SELECT adresse, code_postal, nom_commune FROM touchees
+                    )
+                    """
+                )
+            )
+            adresses_touchees = requete_adresses(
+                "WHERE (adresse, CAST(code_postal AS INTEGER), nom_commune) "
+                "IN (SELECT adresse, code_postal, nom_commune FROM touchees)"
+            )
+            conn.execute(
+                text(f"INSERT INTO {table_adresses} {adresses_touchees}")
+            )
+    print(f"Répertoire d'adresses {table_adresses} à jour")
 
-print("Dataset final prêt :", df_idf.shape)
+    with etape("cube"):
+        if creation or table_cube not in tables_existantes:
+            cible = f"{table_cube}{suffixe}"
+            conn.execute(text(f"DROP TABLE IF EXISTS {cible}"))
+            conn.execute(
+                text(f"CREATE TABLE {cible} AS {requete_cube(source=table_ventes)}")
+            )
+            conn.execute(
+                text(f"CREATE INDEX idx_{cible}_tuile ON {cible} (tuile, annee)")
+            )
+            conn.execute(text(f"ANALYZE {cible}"))
+        else:
+            conn.execute(
+                text(
+                    f"DELETE FROM {table_cube} "
+                    "WHERE tuile IN (SELECT tuile FROM touchees)"
+                )
+            )
+            tuiles_touchees = requete_cube("WHERE tuile IN (SELECT tuile FROM touchees)")
+            conn.execute(text(f"INSERT INTO {table_cube} {tuiles_touchees}"))
+            conn.execute(text(f"ANALYZE {table_cube}"))
+    print(f"Cube d'agrégats {table_cube} à jour")
 
+    if creation:
+        # Échange des tables reconstruites par renommage (verrou exclusif
+        # jusqu'au commit qui suit, sans copie de données), index compris
+        with etape("échange des tables"):
+            conn.execute(
+                text(
+                    f"DROP TABLE IF EXISTS {table}, {table_adresses}, {table_cube} "
+                    "CASCADE"
+                )
+            )
+            for annee in annees:
+                # Une table d'une ingestion mono-année peut porter le nom de la partition
+                conn.execute(text(f"DROP TABLE IF EXISTS {table}_{annee}"))
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {table_ventes}_{annee} RENAME TO {table}_{annee}"
+                    )
+                )
+            for nom in (table, table_adresses, table_cube):
+                conn.execute(text(f"ALTER TABLE {nom}{suffixe} RENAME TO {nom}"))
+            for (index,) in conn.execute(
+                text(
+                    "SELECT indexname FROM pg_indexes "
+                    "WHERE schemaname = current_schema() AND indexname LIKE :motif"
+                ),
+                {"motif": "%" + suffixe.replace("_", r"\_") + "%"},
+            ).fetchall():
+                conn.execute(
+                    text(
+                        f"ALTER INDEX {index} RENAME TO {index.replace(suffixe, '', 1)}"
+                    )
+                )
 
+    # Empreintes des fichiers chargés, écrites dans la même transaction : une
+    # ingestion interrompue est reprise entièrement à l'exécution suivante
+    conn.execute(
+        text(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_fichiers} (
+                annee INTEGER,
+                departement TEXT,
+                empreinte TEXT NOT NULL,
+                date_ingestion TIMESTAMPTZ NOT NULL,
+                PRIMARY KEY (annee, departement)
+            )
+            """
+        )
+    )
+    if creation:
+        conn.execute(text(f"DELETE FROM {table_fichiers}"))
+    conn.execute(
+        text(
+            f"""
+            INSERT INTO {table_fichiers} VALUES (:annee, :departement, :empreinte, now())
+            ON CONFLICT (annee, departement) DO UPDATE
+            SET empreinte = EXCLUDED.empreinte, date_ingestion = EXCLUDED.date_ingestion
+            """
+        ),
+        [
+            {"annee": annee, "departement": dep, "empreinte": empreinte}
+            for annee, dep, empreinte, _ in fichiers_modifies
+        ],
+    )
 
-neon_url = os.getenv("NEON_DB_URL")
-engine = create_engine(neon_url)
+    version = version_fichiers(
+        conn.execute(
+            text(f"SELECT annee, departement, empreinte FROM {table_fichiers}")
+        ).fetchall()
+    )
+    conn.execute(
+        text(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table_metadonnees} (
+                table_donnees TEXT PRIMARY KEY,
+                version TEXT NOT NULL,
+                date_ingestion TIMESTAMPTZ NOT NULL
+            )
+            """
+        )
+    )
+    conn.execute(
+        text(
+            f"""
+            INSERT INTO {table_metadonnees} VALUES (:table, :version, now())
+            ON CONFLICT (table_donnees) DO UPDATE
+            SET version = EXCLUDED.version, date_ingestion = EXCLUDED.date_ingestion
+            """
+        ),
+        {"table": table, "version": version},
+    )
+print(f"Version des données {table} : {version}")
 
-# Envoi du DataFrame dans Neon
-df_idf.to_sql("valeurs_foncieres_idf_2024", engine, if_exists="replace", index=False)
+if fichier_parquet:
+    exporter_parquet(version)
+con.close()
+repertoire_duckdb.cleanup()
@@ -92,7 +92,7 @@ st.markdown(
 
 
 # Fonction de streaming  pour sauvegarder le résultat
-def stream_analysis_sync(adresse, rayon, placeholder):
+def stream_analysis_sync(adresse, rayon, annees, placeholder):
     """
     Version synchrone du streaming et sauvegarde le résultat
     """
@@ -111,7 +111,12 @@ def stream_analysis_sync(adresse, rayon, placeholder):
         # Requête streaming
         response = requests.get(
             f"{API_URL}/analyse_stream",
-            params={"adresse": adresse, "rayon_m": rayon},
+            params={
+                "adresse": adresse,
+                "rayon_m": rayon,
+                "annee_min": annees[0],
+                "annee_max": annees[1],
+            },
             stream=True,
             timeout=600,
         )
@@ -217,6 +222,33 @@ def stream_analysis_sync(adresse, rayon, placeholder):
         st.session_state.analysis_completed = True
 
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def suggerer_adresses(saisie):
+    """
+    Suggestions d'adresses pour la saisie (liste vide en cas d'erreur)
+    """
+    try:
+        res = requests.get(
+            f"{API_URL}/autocomplete", params={"q": saisie, "limite": 8}, timeout=2
+        )
+        res.raise_for_status()
+        return [s["libelle"] for s in res.json().get("suggestions", [])]
+    except requests.exceptions.RequestException:
+        return []
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def annees_disponibles():
+    """
+    Première et dernière années des ventes servies par l'API, (None, None)
+    si aucune vente. Une erreur n'est pas mise en cache
+    """
+    res = requests.get(f"{API_URL}/annees", timeout=5)
+    res.raise_for_status()
+    data = res.json()
+    return data["annee_min"], data["annee_max"]
+
+
 # Sidebar 
 with st.sidebar:
     st.header("Paramètres de recherche")
@@ -227,6 +259,17 @@ with st.sidebar:
         help="Saisissez une adresse en Île-de-France",
     )
 
+    # Suggestions d'adresses (index local de l'API)
+    suggestions = suggerer_adresses(adresse) if len(adresse) >= 3 else []
+    if suggestions:
+        choix = st.selectbox(
+            "Suggestions",
+            ["Adresse saisie"] + suggestions,
+            help="Choisissez une adresse connue pour éviter les erreurs de saisie",
+        )
+        if choix != "Adresse saisie":
+            adresse = choix
+
     rayon = st.slider(
         "Rayon de recherche (mètres)",
         min_value=100,
@@ -236,22 +279,45 @@ with st.sidebar:
         help="Définissez le périmètre de recherche",
     )
 
+    # Bornes du filtre : années ingérées, lues par l'API (toutes les années
+    # si indisponibles)
+    try:
+        annee_min, annee_max = annees_disponibles()
+    except requests.exceptions.RequestException:
+        annee_min = annee_max = None
+    if annee_min is None or annee_min == annee_max:
+        annees = (annee_min, annee_max)
+        if annee_min is not None:
+            st.caption(f"Ventes de {annee_min}")
+    else:
+        annees = st.slider(
+            "Années des ventes",
+            min_value=annee_min,
+            max_value=annee_max,
+            value=(annee_min, annee_max),
+            help="Période des ventes prises en compte",
+        )
+
     st.markdown("---")
     rechercher = st.button("Lancer la recherche", use_container_width=True)
 
 # Initialisation des états de session
 if "biens" not in st.session_state:
-    st.session_state.biens = []
+    st.session_state.biens = pd.DataFrame()
 if "analysis_completed" not in st.session_state:
     st.session_state.analysis_completed = False
 if "analysis_result" not in st.session_state:
     st.session_state.analysis_result = ""
 if "current_search" not in st.session_state:
     st.session_state.current_search = {}
+if "stats" not in st.session_state:
+    st.session_state.stats = {}
 if "stats_per_type" not in st.session_state:
     st.session_state.stats_per_type = {}
 if "coord" not in st.session_state:
     st.session_state.coord = ()
+if "tendance" not in st.session_state:
+    st.session_state.tendance = {}
 
 # Logique de recherche
 if rechercher:
@@ -261,26 +327,39 @@ if rechercher:
         # Réinitialiser l'état de l'analyse pour une nouvelle recherche
         st.session_state.analysis_completed = False
         st.session_state.analysis_result = ""
-        st.session_state.current_search = {"adresse": adresse, "rayon": rayon}
-
+        st.session_state.current_search = {
+            "adresse": adresse,
+            "rayon": rayon,
+            "annees": annees,
+        }
+        params_annees = {"annee_min": annees[0], "annee_max": annees[1]}
+
+        biens = pd.DataFrame()
         with st.spinner("Recherche des biens..."):
             try:
-                # Appel à l'endpoint des données de base
+                # Appel à l'endpoint des données de base (format en colonnes,
+                # chargé directement dans un DataFrame)
                 res = requests.get(
                     f"{API_URL}/biens_proches",
-                    params={"adresse": adresse, "rayon_m": rayon},
+                    params={
+                        "adresse": adresse,
+                        "rayon_m": rayon,
+                        "format": "colonnes",
+                        **params_annees,
+                    },
                 )
                 res.raise_for_status()
                 data = res.json()
 
-                biens = data.get("biens_proches", [])
+                biens = pd.DataFrame(data.get("biens_proches", {}))
                 st.session_state.biens = biens
+                st.session_state.stats = data.get("stats", {})
                 stats_per_type = data.get("stats_per_type", {})
                 st.session_state.stats_per_type = stats_per_type
                 coord = data.get("coord", ())
                 st.session_state.coord = coord
 
-                if not biens:
+                if biens.empty:
                     st.info(
                         "Aucun bien trouvé dans ce rayon. Essayez d'augmenter le périmètre de recherche."
                     )
@@ -288,20 +367,43 @@ if rechercher:
             except Exception as e:
                 st.error(f"Erreur lors de la requête : {e}")
 
+            # Évolution mensuelle des prix du rayon (agrégée par l'API) : en
+            # cas d'erreur, seul le graphique est omis
+            st.session_state.tendance = {}
+            if not biens.empty:
+                try:
+                    res_tendance = requests.get(
+                        f"{API_URL}/tendance",
+                        params={"adresse": adresse, "rayon_m": rayon, **params_annees},
+                    )
+                    res_tendance.raise_for_status()
+                    st.session_state.tendance = res_tendance.json().get("tendance", {})
+                except Exception as e:
+                    st.warning(f"Évolution des prix indisponible : {e}")
+
 # Affichage des résultats
-if st.session_state.biens:
+if not st.session_state.biens.empty:
 
     # Récupération du rayon utilisé pour la recherche actuelle
     rayon_recherche = st.session_state.current_search.get("rayon", rayon)
     adresse_recherche = st.session_state.current_search.get("adresse", adresse)
+    annees_recherche = st.session_state.current_search.get("annees", annees)
 
     # Métriques principales
     st.subheader("Aperçu du marché")
 
-    df_biens = pd.DataFrame(st.session_state.biens)
-    prix_moyen = df_biens["prix_m2"].mean()
-    surface_moyenne = df_biens["surface_reelle_bati"].mean()
-    nb_pieces_moyen = df_biens["nombre_pieces_principales"].mean()
+    # Statistiques de toutes les ventes du rayon (la liste des biens affichés
+    # est limitée aux plus proches)
+    df_biens = st.session_state.biens
+    stats = st.session_state.stats
+    prix_moyen = stats.get("prix_moyen", df_biens["prix_m2"].mean())
+    surface_moyenne = stats.get(
+        "surface_moyenne", df_biens["surface_reelle_bati"].mean()
+    )
+    nb_pieces_moyen = stats.get(
+        "nombre_pieces_moyen", df_biens["nombre_pieces_principales"].mean()
+    )
+    nb_biens = stats.get("nb_biens", len(df_biens))
 
     col1, col2, col3, col4 = st.columns(4)
 
@@ -309,7 +411,7 @@ if st.session_state.biens:
         st.metric(
             label="Prix moyen/m²",
             value=f"{prix_moyen:,.0f} €",
-            delta=f"{len(st.session_state.biens)} biens",
+            delta=f"{nb_biens} biens",
         )
 
     with col2:
@@ -328,12 +430,8 @@ if st.session_state.biens:
         st.subheader("Localisation des biens")
 
         # Calcul du centre basé sur l'adresse recherchée (moyenne des coordonnées)
-        center_lat = sum(bien["latitude"] for bien in st.session_state.biens) / len(
-            st.session_state.biens
-        )
-        center_lon = sum(bien["longitude"] for bien in st.session_state.biens) / len(
-            st.session_state.biens
-        )
+        center_lat = df_biens["latitude"].mean()
+        center_lon = df_biens["longitude"].mean()
 
         # Calcul du zoom optimal basé sur le rayon
         if rayon <= 500:
@@ -386,7 +484,7 @@ if st.session_state.biens:
 
         # Groupement des biens par coordonnées pour gérer les doublons
         biens_groupes = {}
-        for i, bien in enumerate(st.session_state.biens):
+        for i, bien in enumerate(df_biens.to_dict("records")):
             coord_key = f"{bien['latitude']:.6f},{bien['longitude']:.6f}"
             if coord_key not in biens_groupes:
                 biens_groupes[coord_key] = []
@@ -597,6 +695,15 @@ if st.session_state.biens:
                             ),
                             2,
                         ),
+                        "Prix médian/m²": round(
+                            float(
+                                stats_dict.get("prix_m2_median_par_type", {}).get(
+                                    type_bien
+                                )
+                                or 0
+                            ),
+                            2,
+                        ),
                         "Prix min/m²": round(
                             float(stats_dict["prix_m2_min_par_type"].get(type_bien, 0)),
                             2,
@@ -665,6 +772,34 @@ if st.session_state.biens:
                     ),
                 },
             )
+
+    # Évolution mensuelle du prix au m² par type de bien
+    if st.session_state.tendance:
+        st.subheader("Évolution du prix au m²")
+        df_tendance = pd.DataFrame(
+            [
+                {"Type de bien": type_bien, **point}
+                for type_bien, serie in st.session_state.tendance.items()
+                for point in serie
+            ]
+        )
+        fig = px.line(
+            df_tendance,
+            x="mois",
+            y="prix_m2_median",
+            color="Type de bien",
+            markers=True,
+            hover_data={"nombre": True, "prix_m2_moyen": ":,.0f"},
+            labels={
+                "mois": "Mois",
+                "prix_m2_median": "Prix médian/m² (€)",
+                "prix_m2_moyen": "Prix moyen/m² (€)",
+                "nombre": "Ventes",
+            },
+        )
+        fig.update_layout(hovermode="x unified", margin=dict(t=20, b=20))
+        st.plotly_chart(fig, use_container_width=True)
+
     # Section pour l'analyse streaming
     st.subheader("Analyse du marché local")
 
@@ -691,7 +826,10 @@ if st.session_state.biens:
         if st.button("Lancer l'analyse IA", type="primary", use_container_width=False):
             with st.spinner("Analyse en cours..."):
                 stream_analysis_sync(
-                    adresse_recherche, rayon_recherche, analysis_placeholder
+                    adresse_recherche,
+                    rayon_recherche,
+                    annees_recherche,
+                    analysis_placeholder,
                 )
 
     # Tableau des données